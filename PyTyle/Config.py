@@ -14,6 +14,8 @@ class Config:
             'timeout': 0.1,
             'decorations': True,
             'original_decor': True,
+            'event_loop': 'select',
+            'grab_server': False,
         },
         'WORKAREA': {
             0: {
@@ -3,32 +3,26 @@ from PyTyle.State import State
 from PyTyle.Probe import PROBE
 
 from PyTyle.Viewport import Viewport
+from PyTyle.Screen import Screen
+
+import bisect
 
 
 class Desktop:
     # This queries the window manager for all available desktops, and
     # instantiates them. When a desktop is initialized, it will also load each
-    # of its screens (essentially, if xinerama reports two available screens,
-    # then each screen will be attached to every desktop). This method also
-    # takes care of attaching a tiler to each screen, which comes from the
-    # configuration file.
+    # of its viewports. Screens (essentially, if xinerama reports two
+    # available screens, then each screen will be attached to every viewport)
+    # and their tilers are only created once a window shows up on them. See
+    # Viewport.get_screen.
     @staticmethod
     def load_desktops():
-        # initialize all desktops and their associated windows
         for desk in PROBE.get_desktops().values():
-            desktop = Desktop(desk)
-            for viewport in desktop.viewports.values():
-                for screen in viewport.screens.values():
-                    desk_or_view = desktop.id
-                    if PROBE.is_compiz():
-                        desk_or_view = viewport.id
-
-                    screen.set_tiler(
-                        Config.tilers(Config.tiling(screen.id, desk_or_view))
-                    )
+            Desktop(desk)
 
     # Simply refreshes the desktop information. Used mainly when the workarea
-    # changes to accomodate docks/panels.
+    # changes to accomodate docks/panels. (Only the screens of the current
+    # desktop are retiled right away- see State.queue_screen.)
     @staticmethod
     def refresh_desktops():
         for desk in PROBE.get_desktops().values():
@@ -39,38 +33,211 @@ class Desktop:
                     for screen in viewport.screens.values():
                         screen.needs_tiling()
 
-    # Same as 'load_desktops' except we're just refreshing their information.
+    # Brings the desktops up to date after the monitor setup (or the number
+    # of desktops) changed, without throwing everything away. Old screens are
+    # matched up with the new ones (see _match_screens). Screens that
+    # survived keep their windows, tilers and storage (only the ones that
+    # moved or were resized get retiled), and windows on screens that are
+    # gone are moved to whatever screen is now under them. New screens are
+    # created lazily, as usual. New desktops are simply added.
+    #
+    # Returns False if the change is too big to handle this way (desktops
+    # were removed, or the viewports changed), in which case the state must
+    # be wiped and rebuilt.
+    @staticmethod
+    def update_topology():
+        desktops = PROBE.get_desktops()
+        viewports = PROBE.get_viewports()
+
+        if viewports != State.get_viewport_layout():
+            return False
+
+        for desktop_id in State.get_desktops():
+            if desktop_id not in desktops:
+                return False
+
+        screens = PROBE.get_screens()
+        mapping = Desktop._match_screens(
+            list(State.get_screen_layout().values()), screens
+        )
+        State.set_screen_layout(screens)
+
+        for desk in desktops.values():
+            if desk['id'] not in State.get_desktops():
+                Desktop(desk)
+                continue
+
+            desktop = State.get_desktops()[desk['id']]
+            geometry = desktop.get_geometry()
+            desktop.update_attributes(desk)
+
+            removed = []
+            for viewport in desktop.viewports.values():
+                viewport.update_size()
+                removed += viewport.update_screens(mapping)
+
+                # The workarea of a screen depends on the desktop too...
+                if geometry != desktop.get_geometry():
+                    for screen in viewport.screens.values():
+                        screen.needs_tiling()
+
+            for screen in removed:
+                desktop.rehome_windows(screen)
+                State.forget_screen(screen)
+
+        return True
+
+    # Reattaches tilers (from the freshly reloaded configuration file) to
+    # every screen we've created so far. The rest will pick them up when
+    # they're created.
     @staticmethod
     def reload_desktops():
-        # initialize all desktops and their associated windows
         for desktop in State.get_desktops().values():
             for viewport in desktop.viewports.values():
                 for screen in viewport.screens.values():
-                    desk_or_view = desktop.id
-                    if PROBE.is_compiz():
-                        desk_or_view = viewport.id
-
-                    screen.set_tiler(
-                        Config.tilers(Config.tiling(screen.id, desk_or_view))
-                    )
+                    viewport.load_tiler(screen)
                     screen.needs_tiling()
 
     # The desktop constructor takes a dict of attributes fetched from X,
-    # adds itself to the current State and loads all of its screens.
+    # adds itself to the current State and loads all of its viewports. (Their
+    # screens are only created when they're first needed.)
     def __init__(self, attrs):
         self.update_attributes(attrs)
         self._VIEWPORT = None
+        self._index = None
         self.viewports = {}
         State.add_desktop(self)
         self.load_viewports()
 
-    # Probes X for all available viewports. For every desktop, an instance
-    # of each viewport is newly created. (So the total number of 'screens'
-    # in PyTyle is # of physical screens * viewports * desktops.)
+    # Finds the screen that owns the given x,y coordinates, or None if there
+    # isn't one. (The screen is created if this is the first time a window
+    # lands on it.) This used to be a nested loop over every viewport and every
+    # screen (see Viewport.is_on_viewport and Screen.is_on_screen), which is
+    # a lot of work for every ConfigureNotify on a big Compiz grid. Instead,
+    # we look the coordinates up in a grid of cells cut along every viewport
+    # and screen edge (see _build_index). That's two binary searches.
+    def get_screen_at(self, x, y):
+        if self._index is None:
+            self._index = self._build_index()
+
+        xs, ys, cells = self._index
+        cell = cells[bisect.bisect_right(xs, x)][bisect.bisect_right(ys, y)]
+        if cell is None:
+            return None
+
+        viewport, screen_id = cell
+        return viewport.get_screen(screen_id)
+
+    # The geometry (and resolution) of the desktop, in one tuple. Handy for
+    # seeing whether it changed.
+    def get_geometry(self):
+        return (self.x, self.y, self.width, self.height, self.resx, self.resy)
+
+    # Moves every window of a screen that's gone to the screen that's now
+    # under it. (Or to the first screen of the same viewport, if there's
+    # nothing under it anymore.) The new screens are retiled.
+    #
+    # Note: The window's x,y are only where PyTyle last put it (and 0,0 if
+    # it was never tiled), so we ask where it really is. If X can't tell us,
+    # the position it had when we found it will have to do.
+    def rehome_windows(self, oldscreen):
+        for window in list(oldscreen.windows.values()):
+            try:
+                geom = PROBE.get_window_geometry(window.xobj)
+                x, y = geom['x'], geom['y']
+            except:
+                x, y = window.origx, window.origy
+
+            screen = self.get_screen_at(x, y)
+            if not screen:
+                layout = State.get_screen_layout()
+                screen = oldscreen.viewport.get_screen(next(iter(layout)))
+
+            oldscreen.delete_window(window)
+            screen.add_window(window)
+            window.screen = screen
+
+    # Throws away the screen index. It will be rebuilt the next time it's
+    # needed. This *must* be called whenever a viewport or screen of this
+    # desktop is added, removed, moved or resized.
+    def invalidate_index(self):
+        self._index = None
+
+    # Loads all available viewports (see State.get_viewport_layout). For every
+    # desktop, an instance of each viewport is newly created.
     def load_viewports(self):
-        viewports = PROBE.get_viewports()
+        viewports = State.get_viewport_layout()
         for viewport in viewports:
             self.viewports[viewport['id']] = Viewport(self, viewport)
+        self.invalidate_index()
+
+    # Builds the index used by get_screen_at. The edges of every viewport and
+    # screen (and 0, since negative coordinates are special) cut the plane
+    # into cells. Viewport.is_on_viewport and Screen.rect_contains only ever
+    # compare coordinates against those edges, so they give the same answer
+    # for every point of a cell. Thus we only have to ask them once per cell,
+    # using one point of the cell, and remember which screen matched first.
+    # (As a viewport and screen id, since the screen may not exist yet.)
+    def _build_index(self):
+        xs = set([0])
+        ys = set([0])
+        for viewport in self.viewports.values():
+            xs.update((viewport.x, viewport.x + viewport.width))
+            ys.update((viewport.y, viewport.y + viewport.height))
+            for screen_id, x, y, width, height in viewport.get_screen_rects():
+                xs.update((x, x + width))
+                ys.update((y, y + height))
+
+        xs = sorted(xs)
+        ys = sorted(ys)
+
+        # Cell i spans [xs[i - 1], xs[i]). The first and last cells are open
+        # ended, so pick a point just inside them.
+        points_x = [xs[0] - 1] + xs
+        points_y = [ys[0] - 1] + ys
+
+        cells = []
+        for x in points_x:
+            column = []
+            for y in points_y:
+                column.append(self._find_screen(x, y))
+            cells.append(column)
+
+        return (xs, ys, cells)
+
+    # Figures out which of the old screens (by id) became which of the new
+    # screens (by id). A screen with the exact same geometry is the same
+    # screen, whatever id xinerama gives it now. Whatever is left is matched
+    # by id. Old screens that aren't in the result are gone.
+    @staticmethod
+    def _match_screens(old, new):
+        mapping = {}
+        rect = lambda s: (s['x'], s['y'], s['width'], s['height'])
+        unmatched = dict((s['id'], s) for s in new)
+
+        for screen in old:
+            for new_id, candidate in unmatched.items():
+                if rect(candidate) == rect(screen):
+                    mapping[screen['id']] = new_id
+                    del unmatched[new_id]
+                    break
+
+        for screen in old:
+            if screen['id'] not in mapping and screen['id'] in unmatched:
+                mapping[screen['id']] = screen['id']
+                del unmatched[screen['id']]
+
+        return mapping
+
+    # The slow (but obviously correct) way of finding the screen that owns
+    # the given x,y coordinates. Only used to build the index.
+    def _find_screen(self, x, y):
+        for viewport in self.viewports.values():
+            if viewport.is_on_viewport(x, y):
+                for screen_id, sx, sy, width, height in viewport.get_screen_rects():
+                    if Screen.rect_contains(sx, sy, width, height, x, y):
+                        return (viewport, screen_id)
+        return None
 
     # Updates all the desktop attributes.
     def update_attributes(self, attrs):
@@ -82,6 +249,7 @@ class Desktop:
         self.width = attrs['width']
         self.height = attrs['height']
         self.name = attrs['name']
+        self.invalidate_index()
 
     # Useful debugging string representation of the desktop. It prints
     # information about the current desktop, including each of its screens
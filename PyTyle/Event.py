@@ -2,18 +2,92 @@ from PyTyle.Probe import PROBE
 from PyTyle.Debug import DEBUG
 from Xlib import X
 
+import collections
+
 
 class Event:
+    #------------------------------------------------------------------------------
+    # STATIC METHODS
+    #------------------------------------------------------------------------------
+
+    # Drains every event that is already pending on the X connection. This
+    # never blocks- if nothing is pending, the batch is simply empty. (See the
+    # Scheduler for how the main loop waits for events.) Launching a single
+    # application can easily fire off dozens of ConfigureNotify/PropertyNotify
+    # events, and there's no point in refreshing the same window dozens of
+    # times. So we collapse the batch: only one event per (kind, window)
+    # survives. It keeps the position of the first occurrence, but carries the
+    # most recent payload. Key presses are never collapsed- each one is a
+    # separate request from the user. Events we don't care about at all are
+    # simply dropped here, and so are the echoes of our own resizes.
+    @staticmethod
+    def get_batch():
+        batch = collections.OrderedDict()
+        presses = 0
+
+        while PROBE.get_display().pending_events():
+            e = Event()
+            e.update_probe()
+            kind = e.get_kind()
+            if kind == 'keypress':
+                batch[(kind, presses)] = e
+                presses += 1
+            elif kind and not e.is_configure_echo():
+                batch[(kind, e.get_window_id())] = e
+
+        return list(batch.values())
+
+
+    #------------------------------------------------------------------------------
+    # CONSTRUCTOR AND EVENT RELATED METHODS
+    #------------------------------------------------------------------------------
+
     # Each instance represents one event. Upon initialization, we grab that event
-    # from the X server.
-    def __init__(self):
-        self._event = PROBE.get_display().next_event()
+    # from the X server (unless we're handed one that has already been fetched).
+    def __init__(self, event = None):
+        if event is None:
+            event = PROBE.get_display().next_event()
+        self._event = event
+        self._echo = False
+
+    # Lets the Probe know about anything that invalidates what it has cached.
+    # This has to happen for every event- even the ones we otherwise ignore.
+    def update_probe(self):
+        if self._event.type == X.PropertyNotify:
+            PROBE.forget_property(self._event.window.id, self._event.atom)
+        elif self._event.type == X.ConfigureNotify:
+            self._echo = PROBE.track_configure(self._event)
+        elif self._event.type == X.ReparentNotify:
+            PROBE.forget_geometry(self._event.window.id)
+        elif self._event.type == X.DestroyNotify:
+            PROBE.window_destroyed(self._event.window.id)
+
+    # Classifies the event by how the main loop handles it. Two events of the
+    # same kind on the same window are interchangeable- handling the latest
+    # one is just as good as handling all of them. Returns None for events
+    # PyTyle ignores.
+    def get_kind(self):
+        if self.is_keypress():
+            return 'keypress'
+        elif self.is_active_change():
+            return 'active'
+        elif self.is_desktop_change():
+            return 'desktop'
+        elif self.is_windowlist_change():
+            return 'windowlist'
+        elif self.is_window_change() or self.is_state_change():
+            return 'window'
+        elif self.is_workarea_change():
+            return 'workarea'
+        elif self.is_screen_change():
+            return 'screen'
+        return None
 
-    # Fetches the window id from the event. We have to convert it to an int and
-    # then a hex so that it matches up with our dictionary of windows (the State).
+    # Fetches the window id from the event. It's a plain int, just like the
+    # keys of our dictionary of windows (the State).
     def get_window_id(self):
         if self._event and hasattr(self._event, 'window'):
-            return hex(int(self._event.window.id))
+            return int(self._event.window.id)
         return 0
 
     # Fetches the key code from the event object. Make sure it's a KeyPress event.
@@ -57,14 +131,19 @@ class Event:
 
     # Reports whether this event is an active window changing event.
     def is_active_change(self):
-        return self._event and self._event.type == X.PropertyNotify and self._event.atom == PROBE.atom('_NET_ACTIVE_WINDOW')
+        return self._event and self._event.type == X.PropertyNotify and self._event.atom == PROBE.NET_ACTIVE_WINDOW
 
     # Reports whether this event is a desktop changing event. This event is
     # sent from the root window. We use this to update the active window.
     # Although I am thinking of changing to listening for the
     # _NET_ACTIVE_WINDOW instead. Will investigate more later.
     def is_desktop_change(self):
-        return self._event and self._event.type == X.PropertyNotify and (self._event.atom == PROBE.atom('_NET_CURRENT_DESKTOP') or self._event.atom == PROBE.atom('_NET_DESKTOP_VIEWPORT'))
+        return self._event and self._event.type == X.PropertyNotify and (self._event.atom == PROBE.NET_CURRENT_DESKTOP or self._event.atom == PROBE.NET_DESKTOP_VIEWPORT)
+
+    # Reports whether this event is nothing but X confirming a resize that
+    # PyTyle itself requested. See Probe.track_configure.
+    def is_configure_echo(self):
+        return self._echo
 
     # Reports whether the current event is a focus *in* event. (We don't
     # care about focus *out* right now.) We also make sure that this is
@@ -77,21 +156,24 @@ class Event:
     def is_keypress(self):
         return self._event and self._event.type == X.KeyPress
 
-    # Reports whether the screen setup has changed by checking the
-    # _NET_DESKTOP_GEOMETRY property.
+    # Reports whether the screen setup has changed. RandR tells us directly
+    # (if it's available); otherwise we notice the window manager updating
+    # the _NET_DESKTOP_GEOMETRY (or _NET_NUMBER_OF_DESKTOPS) property.
     def is_screen_change(self):
-        return self._event and self._event.type == X.PropertyNotify and (self._event.atom == PROBE.atom('_NET_DESKTOP_GEOMETRY') or self._event.atom == PROBE.atom('_NET_NUMBER_OF_DESKTOPS'))
+        if self._event and PROBE.is_randr_event(self._event):
+            return True
+        return self._event and self._event.type == X.PropertyNotify and (self._event.atom == PROBE.NET_DESKTOP_GEOMETRY or self._event.atom == PROBE.NET_NUMBER_OF_DESKTOPS)
 
     # Reports whether the window's state has changed. If a window's state
     # changes (i.e., it was hidden or something), then we need to refresh
     # its information and tell the screen it needs to be retiled.
     def is_state_change(self):
-        return self._event and self._event.type == X.PropertyNotify and self._event.atom == PROBE.atom('WM_STATE')
+        return self._event and self._event.type == X.PropertyNotify and self._event.atom == PROBE.WM_STATE
 
     # Reports whether the window manager's client list has changed or not.
     # Useful for detecting add/removal of windows.
     def is_windowlist_change(self):
-        return self._event and self._event.type == X.PropertyNotify and self._event.atom == PROBE.atom('_NET_CLIENT_LIST')
+        return self._event and self._event.type == X.PropertyNotify and self._event.atom == PROBE.NET_CLIENT_LIST
 
     # Reports whether the event is a window change or not. We want to know
     # if the window changes whenever it is resized/moved (ConfigureNotify),
@@ -99,7 +181,7 @@ class Event:
     # allows for us to drag windows to and from tiling screens (by using
     # the mouse, keyboard, desktop switch key, etc).
     def is_window_change(self):
-        return self._event and ((self._event.type == X.ConfigureNotify and self._event.event != PROBE.get_root()) or (self._event.type == X.PropertyNotify and self._event.atom == PROBE.atom('_NET_WM_DESKTOP')))
+        return self._event and ((self._event.type == X.ConfigureNotify and self._event.event != PROBE.get_root()) or (self._event.type == X.PropertyNotify and self._event.atom == PROBE.NET_WM_DESKTOP))
 
     # Reports whether we are creating a window or not. This will initiate
     # a scan for new windows in the client list. Why do we scan? Because
@@ -121,4 +203,4 @@ class Event:
     # Reports whether the workarea has changed (i.e., a dock/panel has
     # been added to the screen).
     def is_workarea_change(self):
-        return self._event and self._event.type == X.PropertyNotify and self._event.atom == PROBE.atom('_NET_WORKAREA')
+        return self._event and self._event.type == X.PropertyNotify and self._event.atom == PROBE.NET_WORKAREA
@@ -1,10 +1,77 @@
 from Xlib.display import Display
+from Xlib.protocol import request, rq
+from Xlib.xobject import icccm
+from Xlib.error import XError, BadWindow, BadDrawable
 from Xlib import X, XK, Xatom, Xutil, protocol
-from Xlib.ext import xinerama
-import sys, math
+from Xlib.ext import xinerama, randr
+import sys, math, select, time
 
 
 class Probe:
+    # Every atom PyTyle uses. They are all interned in one go when the Probe
+    # starts up (see intern_atoms), so we never have to ask X about an atom
+    # while handling an event.
+    ATOMS = [
+        'WM_STATE',
+        '_NET_ACTIVE_WINDOW',
+        '_NET_CLIENT_LIST',
+        '_NET_CURRENT_DESKTOP',
+        '_NET_DESKTOP_GEOMETRY',
+        '_NET_DESKTOP_VIEWPORT',
+        '_NET_FRAME_EXTENTS',
+        '_NET_NUMBER_OF_DESKTOPS',
+        '_NET_SUPPORTING_WM_CHECK',
+        '_NET_WM_DESKTOP',
+        '_NET_WM_NAME',
+        '_NET_WM_STATE',
+        '_NET_WM_STATE_HIDDEN',
+        '_NET_WM_STATE_MAXIMIZED_HORZ',
+        '_NET_WM_STATE_MAXIMIZED_VERT',
+        '_NET_WM_STATE_SKIP_PAGER',
+        '_NET_WM_STATE_SKIP_TASKBAR',
+        '_NET_WM_WINDOW_TYPE',
+        '_NET_WM_WINDOW_TYPE_DIALOG',
+        '_NET_WM_WINDOW_TYPE_DOCK',
+        '_NET_WM_WINDOW_TYPE_MENU',
+        '_NET_WM_WINDOW_TYPE_SPLASH',
+        '_NET_WM_WINDOW_TYPE_TOOLBAR',
+        '_NET_WORKAREA',
+        '_OB_WM_STATE_UNDECORATED',
+    ]
+
+    # Window states and window types that mean we shouldn't tile a window.
+    # See get_window.
+    HIDDEN_STATES = [
+        '_NET_WM_STATE_HIDDEN',
+        '_NET_WM_STATE_SKIP_TASKBAR',
+        '_NET_WM_STATE_SKIP_PAGER',
+    ]
+    HIDDEN_TYPES = [
+        '_NET_WM_WINDOW_TYPE_DOCK',
+        '_NET_WM_WINDOW_TYPE_TOOLBAR',
+        '_NET_WM_WINDOW_TYPE_MENU',
+        '_NET_WM_WINDOW_TYPE_SPLASH',
+        '_NET_WM_WINDOW_TYPE_DIALOG',
+    ]
+
+    # The root window properties a window manager has to have set before we
+    # can start. See is_wm_running. The first ones only have to exist (the
+    # client list is empty if there aren't any windows yet), but the desktop
+    # ones are indexed by get_desktops, so they must have values too.
+    WM_PROPERTIES = [
+        '_NET_SUPPORTING_WM_CHECK',
+        '_NET_CLIENT_LIST',
+    ]
+    WM_DESKTOP_PROPERTIES = [
+        '_NET_NUMBER_OF_DESKTOPS',
+        '_NET_WORKAREA',
+        '_NET_DESKTOP_GEOMETRY',
+    ]
+
+    # How long (in seconds) we wait for the echo of a resize before deciding
+    # it isn't coming. See _consume_echo.
+    ECHO_TIMEOUT = 1
+
     # There should only be one Probe instance at any given time. Upon init,
     # instantiate the display object and fetch the root window. We also need to
     # listen to certain events on the root window:
@@ -15,16 +82,120 @@ class Probe:
         self._display = Display()
         self._root = self.get_display().screen().root
         self._wm = ''
+        self._applied = {}
+        self._echoes = {}
+        self._atoms = {}
+        self._cache = {}
+        self._geometry = {}
+        self._listening = set()
+        self._dead = set()
+        self._maximizing = set()
+        self._transaction = 0
+        self._grabbed = False
+        self.intern_atoms()
+        self._hidden_states = set(self.atom(name) for name in self.HIDDEN_STATES)
+        self._hidden_types = set(self.atom(name) for name in self.HIDDEN_TYPES)
+        self._maximized_states = set([
+            self.atom('_NET_WM_STATE_MAXIMIZED_VERT'),
+            self.atom('_NET_WM_STATE_MAXIMIZED_HORZ')
+        ])
         self.determine_window_manager()
         self.get_root().change_attributes(
             event_mask = X.KeyPressMask | X.SubstructureNotifyMask | X.PropertyChangeMask
         )
+        self._listening.add(self.get_root().id)
+        self.get_display().set_error_handler(self._handle_error)
+
+        # With RandR around, X tells us right away when a monitor is plugged
+        # in, unplugged, moved or resized. (See is_randr_event.)
+        self._randr = self.has_randr()
+        if self._randr:
+            self.get_root().xrandr_select_input(
+                randr.RRScreenChangeNotifyMask | randr.RRCrtcChangeNotifyMask
+            )
 
     # Alias to save some typing.
     # Display.intern_atom takes a string representation of an atom, and converts
     # it to its proper integer representation- which is what the X protocol uses.
+    # Atoms never change for the lifetime of a connection, so we look them up
+    # in our table first. (It's only a miss if an atom isn't listed in ATOMS.)
     def atom(self, name):
-        return self.get_display().intern_atom(name)
+        if name not in self._atoms:
+            self._atoms[name] = self.get_display().intern_atom(name)
+        return self._atoms[name]
+
+    # Interns every atom in ATOMS. Doing this one atom at a time would cost us
+    # a round trip each, so all of the requests are sent first, and only then
+    # do we wait for the replies. Each atom is also made an attribute of the
+    # Probe, minus the leading underscore (i.e., PROBE.NET_ACTIVE_WINDOW), so
+    # hot paths like the event checks don't even need the table lookup.
+    def intern_atoms(self):
+        pending = []
+        for name in self.ATOMS:
+            pending.append((name, request.InternAtom(
+                display = self.get_display().display,
+                defer = True,
+                name = name,
+                only_if_exists = False
+            )))
+
+        for name, req in pending:
+            req.reply()
+            self._atoms[name] = req.atom
+            setattr(self, name.lstrip('_'), req.atom)
+
+    # Starts a transaction. Until it's committed, nothing PyTyle asks of X is
+    # flushed, so a whole tiling pass reaches the server in one go instead of
+    # window by window. (Anything that has to wait for a reply flushes anyway-
+    # see prefetch_resize for making sure window_resize doesn't.) With grab = True, the server is also grabbed for the
+    # duration, so that the window manager sees the new layout all at once.
+    # Transactions can be nested- only the outermost one counts.
+    def begin(self, grab = False):
+        if not self._transaction and grab:
+            self.get_display().grab_server()
+            self._grabbed = True
+        self._transaction += 1
+
+    # Makes sure window_resize won't have to ask X anything for the given
+    # windows. It needs _NET_WM_STATE (see is_maximized), and with Compiz the
+    # current viewport too- asking for those in the middle of a transaction
+    # would flush it, one round trip per window. So this is called before a
+    # transaction starts: everything missing from the cache is requested in
+    # one go, and the replies are cached.
+    def prefetch_resize(self, wins):
+        pending = []
+        for win in wins:
+            if win.id in self._listening:
+                pending.append((win, self._request_property(win, self.atom('_NET_WM_STATE'), Xatom.ATOM)))
+        if self.is_compiz():
+            pending.append((self.get_root(), self._request_property(
+                self.get_root(),
+                self.atom('_NET_DESKTOP_VIEWPORT'),
+                Xatom.CARDINAL
+            )))
+
+        for win, req in pending:
+            try:
+                self._collect_property(win, req)
+            except (BadWindow, BadDrawable):
+                self.window_destroyed(win.id)
+
+    # Ends a transaction, and sends everything off to X.
+    def commit(self):
+        self._transaction -= 1
+        if self._transaction:
+            return
+
+        if self._grabbed:
+            self.get_display().ungrab_server()
+            self._grabbed = False
+        self.get_display().flush()
+
+    # Flushes the request queue- unless we're in a transaction, in which case
+    # the flush happens when it's committed.
+    def flush(self):
+        if not self._transaction:
+            self.get_display().flush()
 
     # Finds the name of the current window manager.
     def determine_window_manager(self):
@@ -82,14 +253,22 @@ class Probe:
     # window, and thus give us unknown id's for any given window).
     #
     # Note: It's possible that we won't have an active window.
+    #
+    # Note 2: This gets asked a *lot* (once for every window we load, for
+    # starters), but the answer only changes when the window manager updates
+    # _NET_ACTIVE_WINDOW- and we get a PropertyNotify for that. So it's
+    # cached like any other root window property.
     def get_active_window_id(self):
-        active = self.get_root().get_full_property(
-            self.atom('_NET_ACTIVE_WINDOW'),
-            0
+        active = self._collect_property(
+            self.get_root(),
+            self._request_property(
+                self.get_root(),
+                self.atom('_NET_ACTIVE_WINDOW')
+            )
         )
 
-        if hasattr(active, 'value'):
-            return hex(active.value[0])
+        if active and len(active[1]):
+            return active[1][0]
         else:
             return None
 
@@ -162,10 +341,16 @@ class Probe:
     # two panels (top/bottom, for instance)- so I'm going to enable the
     # config for docks/panels to take effect regardless of the number of
     # screens.
+    #
+    # Note 2: If RandR (1.3 or newer) is available, we ask it instead (see
+    # _get_randr_screens). Xinerama is the fallback.
     def get_screens(self):
         ret = []
 
-        if self.has_xinerama():
+        if self._randr:
+            ret = self._get_randr_screens()
+
+        if not ret and self.has_xinerama():
             screens = self.get_display().xinerama_query_screens().screens
             for i in range(len(screens)):
                 screen = screens[i]
@@ -192,17 +377,70 @@ class Probe:
 
         return ret
 
+    # Reads the geometry of every active CRTC straight from RandR. All of the
+    # CRTCs are asked about in one go. The CRTC showing the primary output
+    # comes first (so it's always screen 0, like xinerama does it), and
+    # CRTCs that show the exact same thing (mirrored outputs) are counted
+    # once. Returns an empty list if RandR doesn't know about any.
+    def _get_randr_screens(self):
+        display = self.get_display()
+        resources = self.get_root().xrandr_get_screen_resources_current()
+        primary = self.get_root().xrandr_get_output_primary().output
+
+        pending = []
+        for crtc in resources.crtcs:
+            pending.append(randr.GetCrtcInfo(
+                display = display.display,
+                defer = True,
+                opcode = display.get_extension_major(randr.extname),
+                crtc = crtc,
+                config_timestamp = resources.config_timestamp
+            ))
+
+        crtcs = []
+        for req in pending:
+            info = req.reply()
+            if info.mode and info.width and info.height:
+                crtcs.append(info)
+
+        crtcs.sort(key = lambda info: primary not in info.outputs)
+
+        ret = []
+        for info in crtcs:
+            rect = (info.x, info.y, info.width, info.height)
+            if rect in [(s['x'], s['y'], s['width'], s['height']) for s in ret]:
+                continue
+
+            ret.append({
+                'id': len(ret),
+                'x': info.x,
+                'y': info.y,
+                'width': info.width,
+                'height': info.height
+            })
+
+        return ret
+
     # Retrieves the current viewport. This is necessary for resizing
     # windows in managers like Compiz! Compiz thinks about windows
     # *relative* to the current viewport, so whenever we resize in a
     # window manager like that, we need to know the current viewport.
+    #
+    # Note: We need this for every resize and every geometry read, but the
+    # viewport only changes when we get a PropertyNotify for it. So it's
+    # cached like any other property of a window we listen to (the root
+    # window, in this case).
     def get_viewport(self):
-        viewport = self.get_root().get_full_property(
-            self.atom('_NET_DESKTOP_VIEWPORT'),
-            Xatom.CARDINAL
+        viewport = self._collect_property(
+            self.get_root(),
+            self._request_property(
+                self.get_root(),
+                self.atom('_NET_DESKTOP_VIEWPORT'),
+                Xatom.CARDINAL
+            )
         )
-        if viewport and hasattr(viewport, 'value'):
-            return {'x': viewport.value[0], 'y': viewport.value[1]}
+        if viewport and len(viewport[1]) >= 2:
+            return {'x': viewport[1][0], 'y': viewport[1][1]}
         return None
 
     # Retrieves all available viewports. It uses some math trickery, but here's
@@ -262,52 +500,281 @@ class Probe:
     # changes- we want to know its new state. (i.e., hidden, resized, desktop
     # or screen changed, etc.)
     #
-    # Note: There is a lot that goes into this method, so please see the comments
-    # below as well.
+    # Note: There is a lot that goes into this, so please see the comments
+    # in _collect_window as well.
     #
     # Note 2: We don't calculate which screen the window is on from here. We do
     # that later (Window.load_window, essentially). However, this method supplies
     # what we need for that calculation- the window's x,y coordinates.
+    #
+    # Note 3: Properties of windows we listen to are cached, and a cached
+    # property is only fetched again once X tells us it changed
+    # (PropertyNotify). So a refresh usually costs just the geometry.
     def get_window(self, win):
+        return self._collect_window(win, self._request_window(win))
+
+    # Same as get_window, but for a whole list of windows at once. Asking X
+    # about one window takes about a dozen requests, and waiting for each
+    # reply before sending the next request adds up fast (think startup with
+    # a hundred windows open). So we send *every* request for *every* window
+    # first, and only then start collecting the replies.
+    #
+    # Returns a dict of window attributes keyed by window id (decimal). Windows
+    # that vanished in the meantime are silently left out.
+    def get_windows_by_id(self, window_ids):
+        pending = []
+        for window_id in window_ids:
+            win = self.get_display().create_resource_object('window', window_id)
+            pending.append((window_id, win, self._request_window(win)))
+
+        info = {}
+        for window_id, win, requests in pending:
+            try:
+                info[window_id] = self._collect_window(win, requests)
+            except XError:
+                continue
+
+        return info
+
+    # Simply fetchs a list of windows from the window manager. The list is
+    # given to us as window id's- we then use that id to create a resource
+    # object from which we can query.
+    def get_windows(self):
+        return self.get_windows_by_id(self.get_window_list())
+
+    # Creates a window resource object from a given window id (decimal).
+    def get_window_by_id(self, window_id):
+        win = self.get_display().create_resource_object('window', window_id)
+        return self.get_window(win)
+
+    # It took me a little bit to figure this one out. So apparently, the
+    # get_geometry window method returns coordinates that we don't care about.
+    # (That is, they are relative to the root window?) So in order to
+    # rectify this, we need to 'translate' the x,y coordinates relative to
+    # that root window. Not very intuitive at all. Kudos to wmctrl for showing
+    # me the light here.
+    #
+    # Note: More testing has revealed different behavior for different window
+    # managers here. For instance, with Compiz, we actually want the raw x,y
+    # coordinates from get_geometry- translating them is bad! We end up with
+    # some pretty big figures. (Viewports..?) I haven't investigated Compiz
+    # thoroughly, but was able to get some minimal functionality by simply
+    # removing the call to translate_coords.
+    #
+    # Note 2: We rarely have to ask at all. Once we know where a window we're
+    # listening to is, we keep track of it from its ConfigureNotify events.
+    # (See track_configure.)
+    def get_window_geometry(self, win):
+        return self._collect_geometry(win, self._request_geometry(win))
+
+    # Sends the geometry requests for a window without waiting for replies.
+    # We translate the root origin instead of the window's x,y (which we don't
+    # know yet), so that both requests can be in flight at the same time.
+    # Translation is linear, so nothing is lost. See _collect_geometry.
+    # We also ask for the window's parent, so we know whether it has a frame.
+    # Nothing is sent if we're already tracking the window's geometry.
+    def _request_geometry(self, win):
+        if win.id in self._geometry:
+            return None
+
+        return (
+            request.GetGeometry(
+                display = self.get_display().display,
+                defer = True,
+                drawable = win
+            ),
+            request.TranslateCoords(
+                display = self.get_display().display,
+                defer = True,
+                src_wid = self.get_root(),
+                dst_wid = win,
+                src_x = 0,
+                src_y = 0
+            ),
+            request.QueryTree(
+                display = self.get_display().display,
+                defer = True,
+                window = win
+            ),
+            win.id in self._listening
+        )
+
+    # Waits for the replies to _request_geometry. Translating the root origin
+    # gives us minus the window's root position; subtracting the raw x,y
+    # leaves us with the position of the window's frame.
+    #
+    # What we keep track of is the raw x,y (relative to the parent- usually
+    # the frame), the root position, the size and whether the window has been
+    # reparented into a frame at all. See track_configure.
+    def _collect_geometry(self, win, pending):
+        if pending:
+            geometry, translation, tree, track = pending
+            try:
+                geometry.reply()
+                translation.reply()
+                tree.reply()
+            except (BadWindow, BadDrawable):
+                self.window_destroyed(win.id)
+                raise
+
+            tracked = {
+                'x': geometry.x,
+                'y': geometry.y,
+                'root_x': -translation.x,
+                'root_y': -translation.y,
+                'width': geometry.width,
+                'height': geometry.height,
+                'framed': tree.parent.id != self.get_root().id
+            }
+            if track and win.id in self._listening:
+                self._geometry[win.id] = tracked
+        else:
+            tracked = self._geometry[win.id]
+
+        x = tracked['root_x'] - tracked['x']
+        y = tracked['root_y'] - tracked['y']
+
+        # This is for compiz (and any other viewport-style WM?)...
+        # looks like we don't need to translate
+        if self.is_compiz():
+            viewport = self.get_viewport()
+            if viewport:
+                x = tracked['x'] + viewport['x']
+                y = tracked['y'] + viewport['y']
+
+        return {
+            'x': x,
+            'y': y,
+            'width': tracked['width'],
+            'height': tracked['height']
+        }
+
+    # Sends a GetProperty request without waiting for the reply. We ask for
+    # plenty of data up front, so that we (almost) never need a second trip.
+    # Returns everything _collect_property needs to finish the job. If we
+    # have the property cached, nothing is sent at all- the cached value is
+    # handed over right away, since the cache might be gone by the time the
+    # value is collected.
+    def _request_property(self, win, prop, prop_type = X.AnyPropertyType, length = 4096):
+        if win.id in self._cache and prop in self._cache[win.id]:
+            return (prop, prop_type, length, None, self._cache[win.id][prop])
+
+        req = request.GetProperty(
+            display = self.get_display().display,
+            defer = True,
+            delete = False,
+            window = win,
+            property = prop,
+            type = prop_type,
+            long_offset = 0,
+            long_length = length
+        )
+
+        # Only cache what we read while we were already listening to the
+        # window. Otherwise we could miss the PropertyNotify telling us the
+        # value changed.
+        return (prop, prop_type, length, req, win.id in self._listening)
+
+    # Waits for the reply to _request_property. Returns None if the property
+    # isn't set, otherwise its (format, value) pair. If the property turned
+    # out to be bigger than what we asked for, the rest is fetched the old
+    # fashioned way.
+    def _collect_property(self, win, pending):
+        prop, prop_type, length, req, cache = pending
+        if req is None:
+            return cache
+
+        req.reply()
+        if not req.property_type:
+            value = None
+        else:
+            fmt, value = req.value
+            if req.bytes_after:
+                rest = win.get_property(
+                    prop,
+                    prop_type,
+                    length,
+                    req.bytes_after // 4 + 1
+                )
+                if rest:
+                    value = value + rest.value
+            value = (fmt, value)
+
+        if cache and win.id in self._listening:
+            self._cache.setdefault(win.id, {})[prop] = value
+
+        return value
+
+    # Sends every request needed to build a window's attributes, without
+    # waiting for any replies. See _collect_window.
+    def _request_window(self, win):
+        requests = {
+            'name': self._request_property(win, self.atom('_NET_WM_NAME')),
+            'wm_name': self._request_property(win, Xatom.WM_NAME),
+            'desktop': self._request_property(win, self.atom('_NET_WM_DESKTOP')),
+            'extents': self._request_property(win, self.atom('_NET_FRAME_EXTENTS')),
+            'hints': self._request_property(
+                win,
+                Xatom.WM_NORMAL_HINTS,
+                Xatom.WM_SIZE_HINTS,
+                icccm.WMNormalHints.static_size // 4
+            ),
+            'transient': self._request_property(
+                win, Xatom.WM_TRANSIENT_FOR, Xatom.WINDOW, 1
+            ),
+            'state': self._request_property(
+                win, self.atom('_NET_WM_STATE'), Xatom.ATOM
+            ),
+            'type': self._request_property(
+                win, self.atom('_NET_WM_WINDOW_TYPE'), Xatom.ATOM
+            ),
+            'class': self._request_property(win, Xatom.WM_CLASS, Xatom.STRING),
+        }
+        requests['geometry'] = self._request_geometry(win)
+
+        return requests
+
+    # Waits for the replies to _request_window, and turns them into the window
+    # data structure.
+    def _collect_window(self, win, requests):
+        # Fetch the window geometry- see get_window_geometry for more info.
+        # (This goes first: if the window is gone, this is where we find out.)
+        wingeom = self._collect_geometry(win, requests['geometry'])
+
         # We don't really need the window name, but it's useful for debugging.
         # If a window doesn't have a name, or the window manager doesn't
         # listen to us, then we can still move on.
-        winname = win.get_full_property(self.atom('_NET_WM_NAME'), 0)
+        winname = self._collect_property(win, requests['name'])
 
         # Another way to find the window name.
+        wm_name = self._collect_property(win, requests['wm_name'])
         if not winname:
-            winname = win.get_full_property(Xatom.WM_NAME, 0)
-            if not winname:
-                winname = ''
+            winname = wm_name
 
         if winname:
-            winname = winname.value
+            winname = winname[1]
+        else:
+            winname = ''
 
         # Fetch the desktop that the window is on.
-        windesk = win.get_full_property(
-            self.atom('_NET_WM_DESKTOP'),
-            0
-        )
+        windesk = self._collect_property(win, requests['desktop'])
 
         # mutter/budgie-wm sometimes refuses to tell us the desktop
         if windesk:
-            windesk = windesk.value[0]
+            windesk = windesk[1][0]
         else:
             print('Warning: assuming desktop 0 for window', winname)
             windesk = 0 # might cause problems
 
-        # Fetch the window geometry- see the method below for more info.
-        wingeom = self.get_window_geometry(win)
-
         # Extents are *hopefully* the window decoration sizes. PyTyle will
         # take these into account when sizing the windows. So far, support
         # seems pretty good for this from WM's.
-        extents = win.get_full_property(self.atom('_NET_FRAME_EXTENTS'), 0)
+        extents = self._collect_property(win, requests['extents'])
 
         if not extents:
             extents = [0, 0, 0, 0]
         else:
-            extents = extents.value
+            extents = extents[1]
 
         # We use the normal hints to find the window's gravity. If the
         # gravity is static, then we need to change it to NorthWest at
@@ -319,12 +786,17 @@ class Probe:
         # it wants, we might get unexpected behavior. So far so good, though.
         # If anyone has a better understanding of gravity than I do (that is,
         # beyond the usual man page), then I'd love to talk to you.
-        norm_hints = win.get_wm_normal_hints()
-
-        if norm_hints and norm_hints['win_gravity'] == X.StaticGravity:
-            static = True
-        else:
-            static = False
+        norm_hints = self._collect_property(win, requests['hints'])
+
+        static = False
+        if norm_hints and norm_hints[0] == 32:
+            norm_hints = rq.encode_array(norm_hints[1])
+            if len(norm_hints) == icccm.WMNormalHints.static_size:
+                norm_hints = icccm.WMNormalHints.parse_binary(
+                    norm_hints,
+                    self.get_display().display
+                )[0]
+                static = norm_hints['win_gravity'] == X.StaticGravity
 
         # So the transient will tell us a window's parent window. Why do we
         # care? Because if a top level window creates a child window (i.e.
@@ -332,9 +804,9 @@ class Probe:
         # property as itself. If we come across transient windows, I don't
         # think we want to tile them. Sometimes the transient is set to the
         # root window, in which case it is obviously a window we want to tile.
-        transient = win.get_wm_transient_for()
+        transient = self._collect_property(win, requests['transient'])
 
-        if not transient or transient == self.get_root():
+        if not transient or transient[0] != 32 or not transient[1] or transient[1][0] == self.get_root().id:
             popup = False
         else:
             popup = True
@@ -345,83 +817,35 @@ class Probe:
         #
         # Note: We check both the '_NET_WM_STATE' (different from 'WM_STATE' which
         # tells us about iconification and stuff) and the '_NET_WM_WINDOW_TYPE'.
-        state = win.get_full_property(self.atom('_NET_WM_STATE'), Xatom.ATOM)
-        dock = win.get_full_property(
-            self.atom('_NET_WM_WINDOW_TYPE'),
-            Xatom.ATOM
-        )
+        state = self._collect_property(win, requests['state'])
+        dock = self._collect_property(win, requests['type'])
+
+        hidden = bool((state and self._hidden_states.intersection(state[1])) or (dock and self._hidden_types.intersection(dock[1])))
 
-        hidden = (state and (self.atom('_NET_WM_STATE_HIDDEN') in state.value or self.atom('_NET_WM_STATE_SKIP_TASKBAR') in state.value or self.atom('_NET_WM_STATE_SKIP_PAGER') in state.value)) or (dock and (self.atom('_NET_WM_WINDOW_TYPE_DOCK') in dock.value or self.atom('_NET_WM_WINDOW_TYPE_TOOLBAR') in dock.value or self.atom('_NET_WM_WINDOW_TYPE_MENU') in dock.value or self.atom('_NET_WM_WINDOW_TYPE_SPLASH') in dock.value or self.atom('_NET_WM_WINDOW_TYPE_DIALOG') in dock.value))
+        # The class is a pair of null separated strings: instance and class.
+        winclass = self._collect_property(win, requests['class'])
+        if winclass and winclass[0] == 8:
+            winclass = winclass[1].decode('latin-1').split('\0')
+            winclass = (winclass[0], winclass[1]) if len(winclass) >= 2 else None
+        else:
+            winclass = None
 
         # Construct the window data structure. This is passed to the
         # update_attributes method.
         return {
-            'id': hex(win.id),
+            'id': win.id,
             'desktop': int(windesk),
             'x': wingeom['x'], 'y': wingeom['y'],
             'width': wingeom['width'], 'height': wingeom['height'],
             'd_left': extents[0], 'd_right': extents[1],
             'd_top': extents[2], 'd_bottom': extents[3],
-            'title': winname, 'class': win.get_wm_class(),
+            'title': winname, 'class': winclass,
             'static': static,
             'popup': popup,
             'hidden': hidden,
             'xobj': win
         }
 
-    # Simply fetchs a list of windows from the window manager. The list is
-    # given to us as window id's- we then use that id to create a resource
-    # object from which we can query.
-    def get_windows(self):
-        info = {}
-        windows = self.get_window_list()
-
-        for window in windows:
-            info[hex(window)] = self.get_window_by_id(window)
-
-        return info
-
-    # Creates a window resource object from a given window id (decimal).
-    def get_window_by_id(self, window_id):
-        win = self.get_display().create_resource_object('window', window_id)
-        return self.get_window(win)
-
-    # It took me a little bit to figure this one out. So apparently, the
-    # get_geometry window method returns coordinates that we don't care about.
-    # (That is, they are relative to the root window?) So in order to
-    # rectify this, we need to 'translate' the x,y coordinates relative to
-    # that root window. Not very intuitive at all. Kudos to wmctrl for showing
-    # me the light here.
-    #
-    # Note: More testing has revealed different behavior for different window
-    # managers here. For instance, with Compiz, we actually want the raw x,y
-    # coordinates from get_geometry- translating them is bad! We end up with
-    # some pretty big figures. (Viewports..?) I haven't investigated Compiz
-    # thoroughly, but was able to get some minimal functionality by simply
-    # removing the call to translate_coords.
-    def get_window_geometry(self, win):
-        wingeom = win.get_geometry()
-
-        wintrans = win.translate_coords(self.get_root(), wingeom.x, wingeom.y)
-        wintrans.x = -wintrans.x
-        wintrans.y = -wintrans.y
-
-        # This is for compiz (and any other viewport-style WM?)...
-        # looks like we don't need to translate
-        if self.is_compiz():
-            viewport = self.get_viewport()
-            if viewport:
-                wintrans = wingeom
-                wintrans.x += viewport['x']
-                wintrans.y += viewport['y']
-
-        return {
-            'x': wintrans.x,
-            'y': wintrans.y,
-            'width': wingeom.width,
-            'height': wingeom.height
-        }
-
     # Queries the window manager for a list of window id's. These window id's
     # are then used to create a window resource object from which we can query
     # for information about that specific window.
@@ -474,21 +898,239 @@ class Probe:
             X.GrabModeAsync
         )
 
+    # Checks if the RandR extension is enabled, and new enough (1.3) to tell
+    # us about CRTCs and the primary output.
+    def has_randr(self):
+        if not self.get_display().has_extension('RANDR'):
+            return False
+
+        version = self.get_display().xrandr_query_version()
+        return (version.major_version, version.minor_version) >= (1, 3)
+
+    # Tells us whether the event is one of the RandR events we asked for in
+    # the constructor- that is, whether the monitor setup changed.
+    def is_randr_event(self, event):
+        if not self._randr:
+            return False
+
+        events = self.get_display().extension_event
+        if event.type == events.ScreenChangeNotify:
+            return True
+
+        code, subcode = events.CrtcChangeNotify
+        return event.type == code and event.sub_code == subcode
+
     # Checks if the xinerama extension is enabled.
     def has_xinerama(self):
         return self.get_display().has_extension('XINERAMA')
 
+    # Every time we resize a window, X tells us about it right back with a
+    # ConfigureNotify- and refreshing the window on our own echo is a waste
+    # of a dozen round trips (and a recipe for feedback loops). So
+    # window_resize remembers what it asked for, and this tells us whether
+    # the event is just that request coming back. Real events carry
+    # coordinates relative to the window's parent. If that's a frame, the
+    # position tells us nothing and only the size is compared- but without a
+    # frame they are root coordinates, so they have to match exactly.
+    # Synthetic events (sent by the window manager) carry root coordinates,
+    # which are off by the decorations- hence the slack.
+    def is_configure_echo(self, target, event):
+        x, y, width, height = target
+        if event.width != width or event.height != height:
+            return False
+
+        if event.send_event:
+            return abs(event.x - x) <= 64 and abs(event.y - y) <= 64
+
+        tracked = self._geometry.get(event.window.id)
+        if tracked and tracked['framed']:
+            return True
+        return event.x == x and event.y == y
+
+    # Figures out whether a ConfigureNotify was caused by our last resize of
+    # the window. Returns what we asked for if so, and None if the event is
+    # somebody else's. We expect at most one event of each flavour, and only
+    # for a little while (ECHO_TIMEOUT)- so once it's here (whether it's an
+    # exact echo or not), the next one isn't ours.
+    def _consume_echo(self, event):
+        echo = self._echoes.get(event.window.id)
+        if not echo:
+            return None
+
+        flavour = 'synthetic' if event.send_event else 'real'
+        if echo['deadline'] < time.monotonic():
+            del self._echoes[event.window.id]
+            return None
+        if flavour not in echo['flavours']:
+            return None
+
+        echo['flavours'].discard(flavour)
+        if not echo['flavours']:
+            del self._echoes[event.window.id]
+        return echo['target']
+
+    # Drops a cached property. This is called for every PropertyNotify we
+    # receive, so that the next read goes to X again. (See Event.get_batch.)
+    # A new _NET_WM_STATE also means a pending maximize has been applied.
+    def forget_property(self, window_id, prop):
+        if prop == self.atom('_NET_WM_STATE'):
+            self._maximizing.discard(window_id)
+        if window_id in self._cache and prop in self._cache[window_id]:
+            del self._cache[window_id][prop]
+
+    # Drops everything we know about a window. We're not listening to it
+    # anymore (or it's gone), so whatever we have cached can't be trusted.
+    def forget_window(self, window_id):
+        self._listening.discard(window_id)
+        self._maximizing.discard(window_id)
+        if window_id in self._cache:
+            del self._cache[window_id]
+        if window_id in self._applied:
+            del self._applied[window_id]
+        if window_id in self._echoes:
+            del self._echoes[window_id]
+        self.forget_geometry(window_id)
+
+    # Stops tracking a window's geometry. The next read will ask X.
+    def forget_geometry(self, window_id):
+        if window_id in self._geometry:
+            del self._geometry[window_id]
+
+    # Keeps the geometry of a window up to date from a ConfigureNotify, so we
+    # don't have to ask X where the window is. There are two flavours:
+    #    1. Real events. These come from X, and the x,y are relative to the
+    #       window's parent (the frame, with a reparenting WM). If the window
+    #       moved within its frame, its root position moved just as much.
+    #    2. Synthetic events. The window manager sends these when it moves
+    #       the frame (ICCCM says it has to). Here, x,y are root coordinates.
+    # Either way, the size is exact.
+    #
+    # Note: Not every window manager bothers with the synthetic event when
+    # the frame is moved *and* resized (which is what a retile does). So if
+    # a framed window changed size, we can't trust its root position anymore
+    # and simply ask X again next time.
+    #
+    # While we're at it, we keep an eye on whether the window is still where
+    # window_resize last put it. Whatever our own resize ends up as (window
+    # managers like to round sizes to the size increments, for one) is
+    # remembered per flavour; anything else that moves or resizes the window
+    # means it isn't anymore.
+    #
+    # Returns whether the event is the echo of our own resize. Note that the
+    # root window gets its own copy of the real events for its children
+    # (SubstructureNotify)- only the window's copy counts.
+    def track_configure(self, event):
+        if event.event.id != event.window.id:
+            return False
+
+        target = self._consume_echo(event)
+        applied = self._applied.get(event.window.id)
+        if applied:
+            flavour = 'synthetic' if event.send_event else 'real'
+            seen = (event.x, event.y, event.width, event.height)
+            if target:
+                applied[flavour] = seen
+            elif applied.get(flavour) != seen:
+                del self._applied[event.window.id]
+
+        echo = target is not None and self.is_configure_echo(target, event)
+
+        tracked = self._geometry.get(event.window.id)
+        if not tracked:
+            return echo
+
+        if event.send_event:
+            tracked['root_x'] = event.x
+            tracked['root_y'] = event.y
+        elif tracked['framed'] and (event.width != tracked['width'] or event.height != tracked['height']):
+            self.forget_geometry(event.window.id)
+            return echo
+        else:
+            tracked['root_x'] += event.x - tracked['x']
+            tracked['root_y'] += event.y - tracked['y']
+            tracked['x'] = event.x
+            tracked['y'] = event.y
+
+        tracked['width'] = event.width
+        tracked['height'] = event.height
+        return echo
+
+    # Reports whether the window is maximized (in either direction). For windows
+    # we listen to, _NET_WM_STATE is cached and kept fresh by PropertyNotify,
+    # so this is usually free. For anything else we can't know for sure
+    # without asking, so we simply assume it is. (Same for a window we've
+    # just asked to maximize- see window_maximize.)
+    def is_maximized(self, win):
+        if win.id not in self._listening or win.id in self._maximizing:
+            return True
+
+        state = self._collect_property(
+            win,
+            self._request_property(win, self.atom('_NET_WM_STATE'), Xatom.ATOM)
+        )
+        return bool(state and self._maximized_states.intersection(state[1]))
+
+    # Reports whether the window is still around. We don't ask X- that would
+    # be a round trip, and this gets asked constantly (see Screen.get_active).
+    # Instead, windows are declared dead when we're told they were destroyed,
+    # or when X complains about them. (See window_destroyed.)
+    #
+    # Note: Unmapped windows are *not* dead. Window managers unmap windows on
+    # other desktops (and iconified windows), and they come right back.
+    def is_alive(self, win):
+        return win.id not in self._dead
+
+    # Declares a window dead, and forgets everything we know about it. This is
+    # called on DestroyNotify, and whenever X tells us the window is bad.
+    # Only the windows we listen to are remembered as dead- the root tells us
+    # about every menu and tooltip that goes away, and nobody asks about those.
+    def window_destroyed(self, window_id):
+        if window_id in self._listening:
+            self._dead.add(window_id)
+        self.forget_window(window_id)
+
     # Checks to see if Compiz is running. It needs unique attention.
     def is_compiz(self):
         return self.get_wm_name() == 'compiz'
 
-    # Reports if the window manager is running or not
+    # Reports if the window manager is running or not. That is, whether it has
+    # set up the root window properties we need: the supporting WM check
+    # window, the client list, and everything get_desktops reads. They are
+    # all asked for in one go (and cached- see wait_for_wm).
     def is_wm_running(self):
-        try:
-            PROBE.get_desktops()
-        except:
-            return False
-        return True
+        names = self.WM_PROPERTIES + self.WM_DESKTOP_PROPERTIES
+        pending = [
+            self._request_property(self.get_root(), self.atom(name))
+            for name in names
+        ]
+
+        running = True
+        for name, req in zip(names, pending):
+            value = self._collect_property(self.get_root(), req)
+            if value is None:
+                running = False
+            elif name in self.WM_DESKTOP_PROPERTIES and not len(value[1]):
+                running = False
+
+        return running
+
+    # Blocks until the window manager is running (see is_wm_running). We
+    # listen to property changes on the root window already, so instead of
+    # polling, we sleep until X tells us that a root window property changed-
+    # and only then look again. (Events that arrive in the meantime are of no
+    # use to us, so they're thrown away after the cache has heard about them.)
+    # Once it's up, find out which window manager it is.
+    def wait_for_wm(self):
+        while not self.is_wm_running():
+            if not self.get_display().pending_events():
+                select.select([self.get_display()], [], [])
+
+            while self.get_display().pending_events():
+                event = self.get_display().next_event()
+                if event.type == X.PropertyNotify:
+                    self.forget_property(event.window.id, event.atom)
+
+        self.determine_window_manager()
 
     # Ungrabs a key (and all its modifiers). This allows us to dynamically reload
     # keybindings as PyTyle is running.
@@ -503,7 +1145,7 @@ class Probe:
     def window_activate(self, win):
         win.set_input_focus(X.RevertToNone, X.CurrentTime)
         self.window_stackabove(win)
-        self.get_display().flush()
+        self.flush()
 
     # Props to devilspie for this one.
     def window_add_decorations(self, win):
@@ -512,7 +1154,7 @@ class Probe:
             self.atom('_NET_WM_STATE'),
             [0, self.atom('_OB_WM_STATE_UNDECORATED')]
         )
-        self.get_display().flush()
+        self.flush()
 
     # This sets up the event mask on the given window. This will tell the
     # X server to send us only the events we're interested in (however,
@@ -532,10 +1174,16 @@ class Probe:
                 X.FocusChangeMask | X.StructureNotifyMask | X.PropertyChangeMask
             )
         )
+        self._listening.add(win.id)
+        self._dead.discard(win.id)
 
     # Simply maximizes a window. We must send a client message event to the
-    # root window for this. (Or any other _NET_WM_STATE_* property.)
+    # root window for this. (Or any other _NET_WM_STATE_* property.) The
+    # window manager hasn't done it yet, so until it tells us the state
+    # changed (PropertyNotify), is_maximized has to assume it did- otherwise
+    # a resize in the meantime would skip the reset.
     def window_maximize(self, win):
+        self._maximizing.add(win.id)
         self._send_event(
             win,
             self.atom('_NET_WM_STATE'),
@@ -545,7 +1193,7 @@ class Probe:
                 self.atom('_NET_WM_STATE_MAXIMIZED_HORZ')
             ]
         )
-        self.get_display().flush()
+        self.flush()
 
     def window_remove_decorations(self, win):
         self._send_event(
@@ -553,7 +1201,7 @@ class Probe:
             self.atom('_NET_WM_STATE'),
             [1, self.atom('_OB_WM_STATE_UNDECORATED')]
         )
-        self.get_display().flush()
+        self.flush()
 
     # Attempts to set window gravity to NorthWest. So far this has been
     # working well, although changing a window's gravity is a hack. See
@@ -564,11 +1212,11 @@ class Probe:
             flags = Xutil.PWinGravity,
             win_gravity = X.NorthWestGravity
         )
-        self.get_display().flush()
+        self.flush()
 
     # This 'unmaximizes' or 'restores' a window. We need to do this
-    # every time we resize a window because it could have been maximized
-    # by the user (which then could not be resized).
+    # before we resize a window that was maximized by the user (which
+    # then could not be resized). See is_maximized.
     def window_reset(self, win):
         self._send_event(
             win,
@@ -579,13 +1227,17 @@ class Probe:
                 self.atom('_NET_WM_STATE_MAXIMIZED_HORZ')
             ]
         )
-        self.get_display().flush()
+        self.flush()
 
     # Resizes the window with the given x/y/width/height pixel values.
-    # Don't forget to flush after and reset the window before.
+    # Don't forget to flush after and reset the window before. (In a
+    # transaction, the flush is left to the commit.)
+    #
+    # Most of the time, a retile puts most windows exactly where they already
+    # are. If the window is still where we last put it (nobody else has
+    # configured it since- see track_configure), we don't bother X at all.
+    # Returns whether anything was sent.
     def window_resize(self, win, x, y, width, height):
-        self.window_reset(win)
-
         # This is for compiz (and any other viewport-style WM?)...
         # looks like we don't need to translate
         if self.is_compiz():
@@ -594,8 +1246,21 @@ class Probe:
                 x -= viewport['x']
                 y -= viewport['y']
 
+        applied = self._applied.get(win.id)
+        if applied and applied['target'] == (x, y, width, height):
+            return False
+
+        if self.is_maximized(win):
+            self.window_reset(win)
         win.configure(x = x, y = y, width = width, height = height)
-        self.get_display().flush()
+        self._applied[win.id] = {'target': (x, y, width, height)}
+        self._echoes[win.id] = {
+            'target': (x, y, width, height),
+            'flavours': set(['real', 'synthetic']),
+            'deadline': time.monotonic() + self.ECHO_TIMEOUT
+        }
+        self.flush()
+        return True
 
     # Puts window at the top of the stack.
     def window_stackabove(self, win):
@@ -610,8 +1275,18 @@ class Probe:
     # in my main event loop. Yuck.
     def window_unlisten(self, win):
         win.change_attributes(event_mask = 0)
+        self.forget_window(win.id)
 
 
+    # Handles errors X reports for requests that don't have a reply (i.e.,
+    # configuring a window that was just destroyed). A window that X calls bad
+    # is a dead window. Anything else is reported the same way Xlib would.
+    def _handle_error(self, error, req):
+        if isinstance(error, (BadWindow, BadDrawable)):
+            self.window_destroyed(getattr(error.resource_id, 'id', error.resource_id))
+        else:
+            print('X protocol error:\n%s' % error, file = sys.stderr)
+
     # Another tricky one to figure out- this will allow you to send
     # a client message to the root window (necessary for removing
     # decorations, maximizing, etc).
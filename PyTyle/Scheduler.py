@@ -0,0 +1,101 @@
+'''
+Keeps track of work that PyTyle wants done a little later. Some events (a
+desktop switch, a new window, a workarea change) arrive before the window
+manager is done shuffling things around, so we give it a moment to settle
+before we react.
+
+We used to just sleep for that moment, but then PyTyle would be deaf to
+everything else- including key presses. Instead, each piece of delayed work
+gets a deadline, and the main loop waits on the X connection *until* the
+nearest deadline. Whatever comes first (an event or a deadline) gets served.
+
+When PyTyle runs on an asyncio event loop instead, the Scheduler is attached
+to that loop and simply hands its deadlines over to loop.call_later.
+'''
+
+import select, time
+
+from PyTyle.Probe import PROBE
+
+
+class Scheduler:
+    def __init__(self):
+        self._jobs = {}
+        self._handles = {}
+        self._loop = None
+        self._after = None
+
+    # Hands the scheduling over to an asyncio event loop. From now on, jobs
+    # are fired by the loop itself (wait and run_due are no longer used). The
+    # optional 'after' callback is run after every job, so that the loop can
+    # deal with whatever the job left behind (i.e., screens to tile).
+    def attach(self, loop, after = None):
+        self._loop = loop
+        self._after = after
+        for name, (deadline, callback) in self._jobs.items():
+            self._handles[name] = loop.call_later(
+                max(0, deadline - time.monotonic()), self._fire, name
+            )
+
+    # Returns how many seconds we can afford to wait before the nearest job
+    # is due. None means there is nothing to wait for.
+    def get_timeout(self):
+        if not self._jobs:
+            return None
+
+        deadline = min(deadline for (deadline, callback) in self._jobs.values())
+        return max(0, deadline - time.monotonic())
+
+    # Runs every job whose deadline has passed, oldest deadline first. A job
+    # is removed before it's run, so it may safely schedule itself again.
+    def run_due(self):
+        now = time.monotonic()
+        due = sorted(
+            (deadline, name) for (name, (deadline, callback)) in self._jobs.items()
+            if deadline <= now
+        )
+
+        for deadline, name in due:
+            if name in self._jobs:
+                deadline, callback = self._jobs.pop(name)
+                callback()
+
+    # Schedules the callback to run after delay seconds. Jobs are named, and
+    # scheduling a job that is already pending does *not* push its deadline
+    # back- it simply swaps in the new callback. That way a flood of events
+    # is handled once, and still no later than 'delay' after the first one.
+    def schedule(self, name, delay, callback):
+        if name in self._jobs:
+            self._jobs[name] = (self._jobs[name][0], callback)
+        else:
+            self._jobs[name] = (time.monotonic() + delay, callback)
+            if self._loop:
+                self._handles[name] = self._loop.call_later(
+                    delay, self._fire, name
+                )
+
+    # Blocks until either X has something for us or the nearest deadline
+    # passes. Returns True if there are events to read. Xlib may already have
+    # events buffered that select() can't see, so ask it first.
+    def wait(self):
+        if PROBE.get_display().pending_events():
+            return True
+
+        readable, writable, errors = select.select(
+            [PROBE.get_display()], [], [], self.get_timeout()
+        )
+        return bool(readable)
+
+    # Runs a single job once its asyncio timer goes off.
+    def _fire(self, name):
+        if name in self._handles:
+            del self._handles[name]
+        if name in self._jobs:
+            deadline, callback = self._jobs.pop(name)
+            callback()
+            if self._after:
+                self._after()
+
+
+# Instantiate the SCHEDULER instance. This is what we import.
+SCHEDULER = Scheduler()
@@ -80,7 +80,7 @@ class Screen:
     def get_workarea(self):
         # If we have one screen, look for a 'Screen 0' config
         # and use it if it exists...
-        if len(self.viewport.screens) == 1:
+        if self.viewport.get_screen_count() == 1:
             if 0 in Config.WORKAREA:
                 x = self.x + Config.workarea(0, 'left')
                 y = self.y + Config.workarea(0, 'top')
@@ -188,10 +188,16 @@ class Screen:
     # position- simply say that it is on the screen with x,y coordinates
     # equal to 0.
     def is_on_screen(self, x, y):
+        return Screen.rect_contains(self.x, self.y, self.width, self.height, x, y)
+
+    # The logic behind is_on_screen, for a screen given by its rectangle. (So
+    # that we can ask before the Screen object exists- see Viewport.get_screen.)
+    @staticmethod
+    def rect_contains(sx, sy, width, height, x, y):
         inGrid = (
-            x >= self.x and y >= self.y and x < (self.x + self.width) and y < (self.y + self.height)
+            x >= sx and y >= sy and x < (sx + width) and y < (sy + height)
         )
-        offScreen = ((x < 0 or y < 0) and self.x == 0 and self.y == 0)
+        offScreen = ((x < 0 or y < 0) and sx == 0 and sy == 0)
         return inGrid or offScreen
 
     # Updates screen with attributes fetched from X. This is actually everything
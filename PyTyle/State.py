@@ -1,11 +1,17 @@
 from PyTyle.Config import Config
 from PyTyle.Probe import PROBE
 
+import collections
+
 class State:
     #------------------------------------------------------------------------------
     # CLASS VARIABLES
     #------------------------------------------------------------------------------
 
+    # The window ids in the client list the last time we looked at it. This is
+    # what State.scan_windows diffs against.
+    _CLIENTS = set()
+
     # Keeps track of the currently active desktop.
     _DESKTOP = None
 
@@ -18,11 +24,30 @@ class State:
     # Tells us whether we need to reload the config file.
     _RELOAD = False
 
-    # Queue of screens to tile. It's flushed at the start of each event loop
-    # iteration.
-    _TO_TILE = []
+    # The physical screens (from xinerama) and the viewports, as reported by
+    # the Probe. Every desktop and viewport shares them, so we only ask X once
+    # (and again after a wipe).
+    _SCREEN_LAYOUT = None
+    _VIEWPORT_LAYOUT = None
 
-    # Keeps a record of all instantiated windows.
+    # Queue of screens to tile. It's flushed at the start of each event loop
+    # iteration. It's really an insertion-ordered set: a screen can be told
+    # that it needs tiling many times over (adding a single window does that
+    # at least twice), but it will only be tiled once per flush.
+    _TO_TILE = collections.OrderedDict()
+
+    # Screens that need tiling, but are on a desktop nobody is looking at.
+    # There's no point tiling those right away (a workarea change or config
+    # reload would otherwise retile every desktop), so they wait here until
+    # their desktop becomes the current one. See queue_screen and
+    # reload_active.
+    _DEFERRED = collections.OrderedDict()
+
+    # Keeps a record of all instantiated windows, keyed by their (int) window
+    # id. This is *the* index from a window id to its Window- and through
+    # window.screen, to the screen that owns it. Screen.add_window and
+    # Screen.delete_window keep it up to date (moving a window to another
+    # screen goes through both).
     # Note: If a window is loaded in this dict, it does *not* mean it will
     # definitely be tiled. Which windows are actually tiled is up to the TileStorage
     # class to determine. (That is where the window filter is used.)
@@ -52,7 +77,7 @@ class State:
     # at the start of each event iteration.
     @staticmethod
     def dequeue_screen():
-        return State._TO_TILE.pop(0)
+        return State._TO_TILE.popitem(last = False)[0]
 
     # Unsets the flag to reload the config file.
     @staticmethod
@@ -79,6 +104,37 @@ class State:
     def get_dispatcher():
         return State._DISPATCHER
 
+    # Retrieves the physical screens, as an ordered dict of screen id to the
+    # attributes from Probe.get_screens. Only the first call talks to X.
+    @staticmethod
+    def get_screen_layout():
+        if State._SCREEN_LAYOUT is None:
+            State._SCREEN_LAYOUT = collections.OrderedDict(
+                (screen['id'], screen) for screen in PROBE.get_screens()
+            )
+        return State._SCREEN_LAYOUT
+
+    # Replaces the physical screens (see get_screen_layout). Used when the
+    # monitor setup changes- see Desktop.update_topology.
+    @staticmethod
+    def set_screen_layout(screens):
+        State._SCREEN_LAYOUT = collections.OrderedDict(
+            (screen['id'], screen) for screen in screens
+        )
+
+    # Retrieves the viewports (see Probe.get_viewports). Only the first call
+    # talks to X.
+    @staticmethod
+    def get_viewport_layout():
+        if State._VIEWPORT_LAYOUT is None:
+            State._VIEWPORT_LAYOUT = PROBE.get_viewports()
+        return State._VIEWPORT_LAYOUT
+
+    # Retrieves a single window by its id, or None if we don't know about it.
+    @staticmethod
+    def get_window(window_id):
+        return State._WINDOWS.get(window_id)
+
     # Retrieves the windows in the state.
     @staticmethod
     def get_windows():
@@ -99,12 +155,37 @@ class State:
     def queue_has_screens():
         return len(State._TO_TILE) > 0
 
+    # Returns the screens waiting in the tiling queue, without dequeuing them.
+    @staticmethod
+    def get_queued_screens():
+        return list(State._TO_TILE)
+
     # Adds a screen to the tiling queue. (You shouldn't use this method
     # directly to queue up a screen, but rather, the 'needs_tiling' method
-    # in the Screen class.)
+    # in the Screen class.) A screen that is already queued keeps its place.
+    # Screens on desktops other than the current one are only deferred.
     @staticmethod
     def queue_screen(screen):
-        State._TO_TILE.append(screen)
+        if screen.viewport.desktop is State._DESKTOP:
+            State._TO_TILE[screen] = True
+        else:
+            State._DEFERRED[screen] = True
+
+    # Takes a screen out of the tiling queue (and the deferred screens). Used
+    # when a screen goes away.
+    @staticmethod
+    def forget_screen(screen):
+        State._TO_TILE.pop(screen, None)
+        State._DEFERRED.pop(screen, None)
+
+    # Moves the deferred screens of the current desktop into the tiling queue.
+    # Called whenever the current desktop changes.
+    @staticmethod
+    def release_deferred():
+        for screen in list(State._DEFERRED):
+            if screen.viewport.desktop is State._DESKTOP:
+                del State._DEFERRED[screen]
+                State._TO_TILE[screen] = True
 
     # Ties a key code to a callback method in the Tile class. Valid key codes
     # can be found in the documentation provided. (But are based on the key symbols
@@ -164,45 +245,56 @@ class State:
             if current and current.id == activeid:
                 return
 
-        State._DESKTOP = State.get_desktops()[PROBE.get_desktop()]
+        desktop = State.get_desktops()[PROBE.get_desktop()]
+        if desktop is not State._DESKTOP:
+            State._DESKTOP = desktop
+            State.release_deferred()
 
         if not activeid:
             if not State._DESKTOP._VIEWPORT:
                 State._DESKTOP._VIEWPORT = State._DESKTOP.viewports[0]
 
             if not State._DESKTOP._VIEWPORT._SCREEN:
-                State._DESKTOP._VIEWPORT._SCREEN = State._DESKTOP._VIEWPORT.screens[0]
+                State._DESKTOP._VIEWPORT._SCREEN = State._DESKTOP._VIEWPORT.get_screen(0)
         else:
-            for viewport in State._DESKTOP.viewports.values():
-                for screen in viewport.screens.values():
-                    if activeid in screen.windows:
-                        State._DESKTOP._VIEWPORT = viewport
-                        State._DESKTOP._VIEWPORT._SCREEN = screen
-                        State._DESKTOP._VIEWPORT._SCREEN.set_active(
-                            screen.windows[activeid]
-                        )
-                        break
-
-    # Similar to scan_new_windows, except it returns all windows reported by
-    # the window manager. We used this when we get a DestroyNotify event: iterate
-    # over the State windows and see which ones aren't in this list and delete
-    # them.
-    @staticmethod
-    def scan_all_windows():
-        return [w for w in PROBE.get_window_list()] # .copy()?
-
-    # There are problems with using the window given via the CreateNotify event
-    # type, and thus, PyTyle currently listens for that event and scans for new
-    # windows manually.
-    @staticmethod
-    def scan_new_windows():
-        ret = []
+            # The window index tells us which screen the window lives on- we
+            # only have to make sure it's on the current desktop.
+            window = State.get_window(activeid)
+            if window and window.screen.viewport.desktop is State._DESKTOP:
+                State._DESKTOP._VIEWPORT = window.screen.viewport
+                State._DESKTOP._VIEWPORT._SCREEN = window.screen
+                State._DESKTOP._VIEWPORT._SCREEN.set_active(window)
+
+    # Fetches the client list from the window manager (once) and compares it
+    # with the windows we've dealt with so far. Returns a tuple of the window
+    # ids that are new (in client list order) and the set of window ids that
+    # were removed. Both are plain ints, and the cost is in the number of
+    # windows that changed- not the number of windows we know about.
+    #
+    # Note: Nothing is remembered here. Once the caller has dealt with the
+    # windows, it has to tell us which ones with update_clients. (Anything it
+    # couldn't deal with will simply show up again next time.)
+    #
+    # Note: There are problems with using the window given via the
+    # CreateNotify event type, and thus, PyTyle currently listens for client
+    # list changes and scans for new windows manually.
+    @staticmethod
+    def scan_windows():
         windows = PROBE.get_window_list()
-        for window in windows:
-            if hex(window) not in State.get_windows():
-                ret.append(window)
+        current = set(windows)
+
+        added = [w for w in windows if w not in State._CLIENTS]
+        removed = State._CLIENTS - current
 
-        return ret
+        return added, removed
+
+    # Records which of the windows from scan_windows have been dealt with:
+    # the added ones we loaded (or decided to skip for good), and the removed
+    # ones we deleted.
+    @staticmethod
+    def update_clients(added, removed):
+        State._CLIENTS.update(added)
+        State._CLIENTS.difference_update(removed)
 
     # UN-registers all the key bindings specified in the configuration file. This
     # allows us to dynamically change key bindings as PyTyle is running.
@@ -239,7 +331,11 @@ class State:
     # Wipes the current state. Useful for when the screen orientation changes.
     @staticmethod
     def wipe():
+        State._CLIENTS = set()
+        State._SCREEN_LAYOUT = None
+        State._VIEWPORT_LAYOUT = None
         State._DESKTOP = None
         State._WINDOWS = {}
         State._DESKTOPS = {}
-        State._TO_TILE = []
+        State._TO_TILE = collections.OrderedDict()
+        State._DEFERRED = collections.OrderedDict()
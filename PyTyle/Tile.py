@@ -16,6 +16,7 @@ import sys, os, time
 
 from PyTyle.Config import Config
 from PyTyle.State import State
+from PyTyle.Probe import PROBE
 from PyTyle.Debug import DEBUG
 import traceback
 
@@ -78,7 +79,13 @@ class Tile:
         else:
             action = eval('Tile.' + action)
 
-        action(tiler)
+        # Everything the action asks of X goes out in one batch.
+        PROBE.prefetch_resize([window.xobj for window in tiler.screen.windows.values()])
+        PROBE.begin(Config.misc('grab_server'))
+        try:
+            action(tiler)
+        finally:
+            PROBE.commit()
 
 
     #------------------------------------------------------------------------------
@@ -185,19 +192,19 @@ class Tile:
         if self.screen.id == screen_num:
             return
 
-        for screen in self.screen.viewport.screens.values():
-            if screen_num == screen.id:
-                add = self.screen.get_active()
-                self.screen.delete_window(add)
-                self.storage.remove(add)
-                screen.add_window(add)
-                screen.get_tiler().storage.add(add)
+        screen = self.screen.viewport.get_screen(screen_num)
+        if screen:
+            add = self.screen.get_active()
+            self.screen.delete_window(add)
+            self.storage.remove(add)
+            screen.add_window(add)
+            screen.get_tiler().storage.add(add)
 
-                if not screen.is_tiling():
-                    add.resize(screen.x, screen.y, add.width, add.height)
+            if not screen.is_tiling():
+                add.resize(screen.x, screen.y, add.width, add.height)
 
-                add.screen = screen
-                self.screen.get_active().activate()
+            add.screen = screen
+            self.screen.get_active().activate()
 
     # Increases the area of the master pane. What this does is up to your tiling
     # algorithm. Pay special attention to the proper resizing of any other pane(s).
@@ -223,14 +230,15 @@ class Tile:
     def _add_master(self):
         # use active window if it's a slave
         slaves = self.storage.get_slaves()
-        if self.screen.get_active().id in self.storage.get_slaves_by_id():
+        if self.storage.is_slave(self.screen.get_active()):
             self.storage.inc_master_count()
             self.storage.remove(self.screen.get_active())
             self.storage.add(self.screen.get_active())
         elif slaves:
+            slave = slaves[0]
             self.storage.inc_master_count()
-            self.storage.remove(slaves[0])
-            self.storage.add(slaves[0])
+            self.storage.remove(slave)
+            self.storage.add(slave)
         else:
             return
 
@@ -251,14 +259,15 @@ class Tile:
 
         # make sure the current window is a master...
         masters = self.storage.get_masters()
-        if self.screen.get_active().id in self.storage.get_masters_by_id():
+        if self.storage.is_master(self.screen.get_active()):
             self.storage.dec_master_count()
             self.storage.remove(self.screen.get_active())
             self.storage.add(self.screen.get_active())
         elif masters:
+            master = masters[0]
             self.storage.dec_master_count()
-            self.storage.remove(masters[0])
-            self.storage.add(masters[0])
+            self.storage.remove(master)
+            self.storage.add(master)
         else:
             return
 
@@ -392,22 +401,19 @@ class Tile:
     # from your tiling algorithm.
     def help_reload(self):
         # delete first...
-        for win in self.storage.get_all():
+        for win in list(self.storage.get_all()):
             if win.id not in self.screen.windows or win.hidden:
                 self.storage.remove(win)
 
         # gobble up active window first in case we need a master...
         # and then just add away...
-        masters = self.storage.get_masters_by_id()
-
-        if self.screen.get_active() and len(masters) < self.storage.get_master_count() and self.screen.get_active().id in self.screen.windows and self.screen.get_active().id not in masters:
-            self.storage.remove(self.screen.get_active())
-            self.storage.add(self.screen.get_active())
-            masters = self.storage.get_masters_by_id()
+        active = self.screen.get_active()
+        if active and len(self.storage.get_masters()) < self.storage.get_master_count() and active.id in self.screen.windows and not self.storage.is_master(active):
+            self.storage.remove(active)
+            self.storage.add(active)
 
-        all = self.storage.get_all_by_id()
         for window in self.screen.windows.values():
-            if not window.id in all:
+            if not self.storage.has(window):
                 self.storage.add_bottom(window)
             else:
                 self.storage.try_to_promote(window)
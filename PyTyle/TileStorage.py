@@ -16,28 +16,96 @@ it will have a place in PyTyle, the tiling algorithm will not be able
 to see it.
 '''
 
+import collections, itertools
+
+class TileView:
+    # A read-only, live view of some part of a TileStorage (the masters, the
+    # slaves or all of them- in that order). This is what get_masters,
+    # get_slaves and get_all hand out, so that the hot paths (every tiling,
+    # every Screen.get_active) don't build new lists all the time. It can be
+    # iterated, indexed (and sliced), measured with len and tested for truth,
+    # just like the lists it replaces.
+    #
+    # Note: It's *live*. If you change the storage while holding a view, the
+    # view changes too- so grab the window you want out of it (or make a list)
+    # before removing/adding windows. Also, don't change the storage while
+    # iterating over a view.
+    def __init__(self, storage, *sections):
+        self._storage = storage
+        self._sections = sections
+        self._version = None
+        self._windows = None
+
+    def __add__(self, other):
+        return list(self) + list(other)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __contains__(self, window):
+        slot = self._storage._slots.get(window.id)
+        return slot is not None and any(slot[0] is section for section in self._sections)
+
+    def __getitem__(self, index):
+        return self._list()[index]
+
+    def __iter__(self):
+        for section in self._sections:
+            for window in section.values():
+                yield window
+
+    def __len__(self):
+        return sum(len(section) for section in self._sections)
+
+    def __repr__(self):
+        return repr(self._list())
+
+    # Indexing needs positions, which the ordered dicts don't have. So we keep
+    # a list around- but only rebuild it after the storage has changed.
+    def _list(self):
+        if self._version != self._storage._version:
+            self._windows = list(self)
+            self._version = self._storage._version
+        return self._windows
+
+
 class TileStorage:
     #------------------------------------------------------------------------------
     # CONSTRUCTOR AND INSTANCE METHODS
     #------------------------------------------------------------------------------
 
     # Will start the master count at 1, and initialize the master and slave
-    # *ordered* lists.
+    # *ordered* dicts.
+    #
+    # Note: Masters and slaves are kept in ordered dicts that map a 'slot' to
+    # a window. A slot is just a unique number that marks a position in the
+    # order; it never moves, but the window in it can change. (That's what
+    # makes switching two windows cheap.) The _slots dict maps a window id to
+    # the dict it's in and its slot, so that finding, removing, switching and
+    # promoting a window never has to search through the storage.
     def __init__(self):
         self._master_count = 1
-        self._masters = []
-        self._slaves = []
+        self._masters = collections.OrderedDict()
+        self._slaves = collections.OrderedDict()
+        self._slots = {}
+        self._next_slot = itertools.count()
+
+        # Bumped on every change, so views know when to rebuild their lists.
+        self._version = 0
+        self._master_view = TileView(self, self._masters)
+        self._slave_view = TileView(self, self._slaves)
+        self._all_view = TileView(self, self._masters, self._slaves)
 
     # Adds a window to the storage. This will detect if that window should
     # be a slave or a master based on the current master count and how
-    # many masters are currently loaded in the storage.
+    # many masters are currently loaded in the storage. (A window that is
+    # already in the storage is moved.)
     def add(self, window):
         if window.hidden:
             return
 
+        self.remove(window)
         if len(self._masters) < self.get_master_count():
-            if window.id in self.get_slaves_by_id():
-                self._remove_slave(window)
             self._add_master(window)
         else:
             self._add_slave(window)
@@ -46,9 +114,8 @@ class TileStorage:
         if window.hidden:
             return
 
+        self.remove(window)
         if len(self._masters) < self.get_master_count():
-            if window.id in self.get_slaves_by_id():
-                self._remove_slave(window)
             self._add_top_master(window)
         else:
             self._add_top_slave(window)
@@ -57,9 +124,8 @@ class TileStorage:
         if window.hidden:
             return
 
+        self.remove(window)
         if len(self._masters) < self.get_master_count():
-            if window.id in self.get_slaves_by_id():
-                self._remove_slave(window)
             self._add_bottom_master(window)
         else:
             self._add_bottom_slave(window)
@@ -71,35 +137,39 @@ class TileStorage:
             return
         self._master_count -= 1
 
-    # Returns all windows currently in the storage.
+    # Returns all windows currently in the storage: masters first, then
+    # slaves. (This, get_masters and get_slaves return a TileView- not a
+    # list. Nothing is copied.)
     def get_all(self):
-        return self.get_masters() + self.get_slaves()
+        return self._all_view
 
     # Returns all windows currently in the storage by their id.
     def get_all_by_id(self):
         return self.get_masters_by_id() + self.get_slaves_by_id()
 
-    # Returns all masters currently in the storage. It will
-    # conveniently extract the windows from the tupling storage
-    # mechanism.
+    # Returns all masters currently in the storage, in order.
     def get_masters(self):
-        return [window for (title, window) in self._masters]
+        return self._master_view
 
     # Returns all the masters' ids.
     def get_masters_by_id(self):
-        return [window.id for (title, window) in self._masters]
+        return [window.id for window in self._masters.values()]
 
     # Returns the number of masters currently allowed.
     def get_master_count(self):
         return self._master_count
 
-    # Returns all slaves currently in the storage.
+    # Returns all slaves currently in the storage, in order.
     def get_slaves(self):
-        return [window for (title, window) in self._slaves]
+        return self._slave_view
 
     # Returns all slaves' ids.
     def get_slaves_by_id(self):
-        return [window.id for (title, window) in self._slaves]
+        return [window.id for window in self._slaves.values()]
+
+    # Tells us whether the window is in the storage (as a master or a slave).
+    def has(self, window):
+        return window.id in self._slots
 
     # Tells the tiling storage to allow for one more master.
     # There is no theoretical limit.
@@ -113,47 +183,56 @@ class TileStorage:
     def inc_master_count(self):
         self._master_count += 1
 
-    # Removes a window from the storage.
+    # Tells us whether the window is a master.
+    def is_master(self, window):
+        return window.id in self._slots and self._slots[window.id][0] is self._masters
+
+    # Tells us whether the window is a slave.
+    def is_slave(self, window):
+        return window.id in self._slots and self._slots[window.id][0] is self._slaves
+
+    # Removes a window from the storage. Nothing happens if it isn't there.
     def remove(self, window):
-        if window.id in self.get_masters_by_id():
-            self._remove_master(window)
-        if window.id in self.get_slaves_by_id():
-            self._remove_slave(window)
+        if window.id in self._slots:
+            windows, slot = self._slots.pop(window.id)
+            del windows[slot]
+            self._version += 1
 
-    # Will sort the entire storage. This is currently
+    # Will sort the entire storage (by window title). This is currently
     # only called when you need to reload your storage.
     # It is not recommended to do so elsewhere, as it might
     # introduce inconsistencies between the storage and
     # the screen.
     def sort(self):
-        self._masters.sort()
-        self._slaves.sort()
+        for windows in (self._masters, self._slaves):
+            ordered = sorted(windows.values(), key = lambda w: w.title.lower())
+            windows.clear()
+            for window in ordered:
+                self._add(windows, window)
+        self._version += 1
 
     # Will switch any two windows. This preseves the
     # representation of storage as it pertains to the
     # screen's physical appearence.
     def switch(self, win1, win2):
-        for i in range(len(self._masters)):
-            win = self._masters[i][1]
-            if win1.id == win.id:
-                self._masters[i] = (win2.title.lower(), win2)
-            if win2.id == win.id:
-                self._masters[i] = (win1.title.lower(), win1)
-
-        for i in range(len(self._slaves)):
-            win = self._slaves[i][1]
-            if win1.id == win.id:
-                self._slaves[i] = (win2.title.lower(), win2)
-            if win2.id == win.id:
-                self._slaves[i] = (win1.title.lower(), win1)
+        if win1.id not in self._slots or win2.id not in self._slots:
+            return
+
+        windows1, slot1 = self._slots[win1.id]
+        windows2, slot2 = self._slots[win2.id]
+        windows1[slot1] = win2
+        windows2[slot2] = win1
+        self._slots[win1.id] = (windows2, slot2)
+        self._slots[win2.id] = (windows1, slot1)
+        self._version += 1
 
     # This will try to promote a given window (has to be
     # a slave) to master status. Useful for reloading the
     # storage. (There could be slaves and extra room for
     # masters.)
     def try_to_promote(self, window):
-        if len(self._masters) < self.get_master_count() and window.id in self.get_slaves_by_id():
-            self._remove_slave(window)
+        if len(self._masters) < self.get_master_count() and self.is_slave(window):
+            self.remove(window)
             self._add_master(window)
 
 
@@ -161,61 +240,57 @@ class TileStorage:
     # PRIVATE HELPER (INSTANCE) METHODS
     #------------------------------------------------------------------------------
 
+    # Puts the window in a new slot at the end of the given dict (masters
+    # or slaves) and remembers where we put it. Everything that adds a
+    # window goes through here.
+    def _add(self, windows, window):
+        slot = next(self._next_slot)
+        windows[slot] = window
+        self._slots[window.id] = (windows, slot)
+        self._version += 1
+        return slot
+
     # Explicitly adds a master to the storage. Please do not
     # call this directly, as it doesn't sync with the master
     # count.
     def _add_master(self, window):
-        self._masters.append((window.title.lower(), window))
+        self._add(self._masters, window)
 
     # Explicitly adds a slave to the storage.
     def _add_slave(self, window):
-        self._slaves.append((window.title.lower(), window))
+        self._add(self._slaves, window)
 
     # Explicitly adds a master to the storage. Please do not
     # call this directly, as it doesn't sync with the master
     # count.
     def _add_bottom_master(self, window):
-        self._masters.append((window.title.lower(), window))
+        self._add(self._masters, window)
 
     # Explicitly adds a slave to the storage.
     def _add_bottom_slave(self, window):
-        self._slaves.append((window.title.lower(), window))
+        self._add(self._slaves, window)
 
     # Explicitly adds a master to the storage. Please do not
     # call this directly, as it doesn't sync with the master
     # count.
     def _add_top_master(self, window):
-        self._masters.insert(0, (window.title.lower(), window))
+        self._masters.move_to_end(self._add(self._masters, window), last = False)
+        self._version += 1
 
     # Explicitly adds a slave to the storage.
     def _add_top_slave(self, window):
-        self._slaves.insert(0, (window.title.lower(), window))
-
-    # Explicitly removes a master from the storage.
-    def _remove_master(self, window):
-        for i in range(len(self._masters)):
-            win = self._masters[i][1]
-            if window.id == win.id:
-                del self._masters[i]
-                break
-
-    # Explicitly removes a slave from the storage.
-    def _remove_slave(self, window):
-        for i in range(len(self._slaves)):
-            win = self._slaves[i][1]
-            if window.id == win.id:
-                del self._slaves[i]
-                break
+        self._slaves.move_to_end(self._add(self._slaves, window), last = False)
+        self._version += 1
 
     # A nice output of the current storage. Useful for
     # debugging.
     def __str__(self):
         ret = 'Master(s):\n'
         for master in self.get_masters():
-            ret += '\t%s - %s\n' % (master.title, master.id)
+            ret += '\t%s - %s\n' % (master.title, hex(master.id))
 
         ret += 'Slave(s):\n'
         for slave in self.get_slaves():
-            ret += '\t%s - %s\n' % (slave.title, slave.id)
+            ret += '\t%s - %s\n' % (slave.title, hex(slave.id))
 
         return ret
@@ -107,20 +107,17 @@ class Cascade(TileDefault):
     # of the window stack instead.
     def help_reload(self):
         # delete first...
-        for win in self.storage.get_all():
+        for win in list(self.storage.get_all()):
             if win.id not in self.screen.windows or win.hidden:
                 self.storage.remove(win)
 
-        masters = self.storage.get_masters_by_id()
+        active = self.screen.get_active()
+        if active and len(self.storage.get_masters()) < self.storage.get_master_count() and active.id in self.screen.windows and not self.storage.is_master(active):
+            self.storage.remove(active)
+            self.storage.add(active)
 
-        if self.screen.get_active() and len(masters) < self.storage.get_master_count() and self.screen.get_active().id in self.screen.windows and self.screen.get_active().id not in masters:
-            self.storage.remove(self.screen.get_active())
-            self.storage.add(self.screen.get_active())
-            masters = self.storage.get_masters_by_id()
-
-        all = self.storage.get_all_by_id()
         for window in self.screen.windows.values():
-            if not window.id in all:
+            if not self.storage.has(window):
                 self.storage.add_top(window)
             else:
                 self.storage.try_to_promote(window)
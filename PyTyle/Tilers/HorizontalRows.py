@@ -170,7 +170,6 @@ class HorizontalRows(TileDefault):
     def help_find_next(self):
         masters = self.storage.get_masters()
         slaves = self.storage.get_slaves()
-        all = masters + slaves
 
         if masters and self.screen.get_active().id == masters[-1].id:
             if not slaves:
@@ -182,7 +181,7 @@ class HorizontalRows(TileDefault):
                 return slaves[0]
             else:
                 return masters[0]
-        elif slaves and self.screen.get_active().id in [win.id for win in slaves]:
+        elif slaves and self.storage.is_slave(self.screen.get_active()):
             for i in range(len(slaves) - 1):
                 if self.screen.get_active().id == slaves[i].id:
                     return slaves[(i + 1)]
@@ -197,7 +196,6 @@ class HorizontalRows(TileDefault):
     def help_find_previous(self):
         masters = self.storage.get_masters()
         slaves = self.storage.get_slaves()
-        all = masters + slaves
 
         if masters and self.screen.get_active().id == masters[0].id:
             if not slaves:
@@ -209,7 +207,7 @@ class HorizontalRows(TileDefault):
                 return slaves[-1]
             else:
                 return masters[-1]
-        elif masters and self.screen.get_active().id in [win.id for win in masters]:
+        elif masters and self.storage.is_master(self.screen.get_active()):
             for i in range(1, len(masters)):
                 if self.screen.get_active().id == masters[i].id:
                     return masters[(i - 1)]
@@ -5,7 +5,7 @@ class Maximal(TileDefault):
     def _tile(self):
         x, y, width, height = self.screen.get_workarea()
 
-        for window in self.storage.get_masters() + self.storage.get_slaves():
+        for window in self.storage.get_all():
             self.help_resize(
                 window,
                 x,
@@ -1,3 +1,4 @@
+from PyTyle.Config import Config
 from PyTyle.State import State
 from PyTyle.Probe import PROBE
 from PyTyle.Screen import Screen
@@ -13,16 +14,44 @@ class Viewport:
         self.update_attributes(attrs)
         self._SCREEN = None
         self.desktop = desktop
+        self.update_size()
 
-        if PROBE.is_compiz():
-            self.width = self.desktop.width
-            self.height = self.desktop.height
-        else:
-            self.width = self.desktop.resx
-            self.height = self.desktop.resy
-
+        # Only the screens that have been used so far. See get_screen.
         self.screens = {}
-        self.load_screens()
+
+    # Fetches the screen with the given id, creating it (and its tiler) the
+    # first time it's asked for. Returns None if there is no such screen.
+    #
+    # Note: There is an instance of each screen for every viewport of every
+    # desktop. (So the total number of 'screens' in PyTyle could be # of
+    # physical screens * viewports * desktops.) Most of them will never see a
+    # window, so we don't bother creating them until a window lands on them.
+    # We do *not* queue screens for tiling here.
+    def get_screen(self, screen_id):
+        if screen_id not in self.screens:
+            layout = State.get_screen_layout()
+            if screen_id not in layout:
+                return None
+
+            screen = Screen(self, layout[screen_id])
+            screen.x += self.x
+            screen.y += self.y
+            self.load_tiler(screen)
+            self.screens[screen_id] = screen
+
+        return self.screens[screen_id]
+
+    # The number of physical screens- whether we've created them or not.
+    def get_screen_count(self):
+        return len(State.get_screen_layout())
+
+    # The id, x, y, width and height of every screen on this viewport- whether
+    # we've created them or not. (The desktop uses this to build its index.)
+    def get_screen_rects(self):
+        return [
+            (attrs['id'], attrs['x'] + self.x, attrs['y'] + self.y, attrs['width'], attrs['height'])
+            for attrs in State.get_screen_layout().values()
+        ]
 
     # Takes a pair of x,y coordinates and tells us whether they are in the
     # viewport's grid. Also, take special care for windows with a negative x,y
@@ -35,17 +64,57 @@ class Viewport:
         )
         return offScreen or onViewport
 
-    # Probes X (using xinerama) for all available screens. For every viewport,
-    # an instance of each screen is newly created. (So the total number of
-    # 'screens' in PyTyle is # of physical screens * viewports * desktops.) We
-    # do *not* queue screens for tiling here.
-    def load_screens(self):
-        screens = PROBE.get_screens()
-        for screen in screens:
-            obj = Screen(self, screen)
-            obj.x += self.x
-            obj.y += self.y
-            self.screens[screen['id']] = obj
+    # Attaches a tiler to the given screen, which comes from the
+    # configuration file. (Compiz users configure tiling per viewport
+    # instead of per desktop.)
+    def load_tiler(self, screen):
+        desk_or_view = self.desktop.id
+        if PROBE.is_compiz():
+            desk_or_view = self.id
+
+        screen.set_tiler(
+            Config.tilers(Config.tiling(screen.id, desk_or_view))
+        )
+
+    # Updates the screens we've created after the physical screens changed.
+    # The mapping tells us the new id of each old screen id that survived
+    # (see Desktop.update_topology). Surviving screens keep their windows,
+    # tiler and storage, and are retiled if they moved or were resized.
+    # Returns the screens that are gone. (Their windows need a new home.)
+    def update_screens(self, mapping):
+        layout = State.get_screen_layout()
+        screens = {}
+        removed = []
+
+        for screen_id, screen in self.screens.items():
+            if screen_id not in mapping:
+                removed.append(screen)
+                if self._SCREEN is screen:
+                    self._SCREEN = None
+                continue
+
+            attrs = layout[mapping[screen_id]]
+            rect = (screen.x, screen.y, screen.width, screen.height)
+
+            screen.update_attributes(attrs)
+            screen.x += self.x
+            screen.y += self.y
+            screens[screen.id] = screen
+
+            if rect != (screen.x, screen.y, screen.width, screen.height):
+                screen.needs_tiling()
+
+        self.screens = screens
+        return removed
+
+    # Sets the size of the viewport from its desktop.
+    def update_size(self):
+        if PROBE.is_compiz():
+            self.width = self.desktop.width
+            self.height = self.desktop.height
+        else:
+            self.width = self.desktop.resx
+            self.height = self.desktop.resy
 
     # Updates viewport with attributes fetched from X.
     def update_attributes(self, attrs):
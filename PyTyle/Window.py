@@ -26,14 +26,27 @@ class Window:
     # STATIC METHODS
     #------------------------------------------------------------------------------
 
-    # This method uses the State to scan for any new windows (not currently in
-    # the WINDOW state dict), and loads them into PyTyle. This is called at
-    # program start up, and also when a new window has been created.
+    # This method uses the State to scan for any new windows (ones that
+    # weren't in the client list last time we looked), and loads them into
+    # PyTyle. This is called at program start up, and after the state has
+    # been wiped.
     @staticmethod
     def load_new_windows():
-        wins = State.scan_new_windows()
-        for win in wins:
-            Window.load_window(win)
+        added, removed = State.scan_windows()
+        State.update_clients(Window.load_windows(added), [])
+
+    # Loads the windows with the given ids. All of them are probed in one go
+    # (see Probe.get_windows_by_id). Returns the ids of the windows that were
+    # dealt with (see load_window).
+    @staticmethod
+    def load_windows(window_ids):
+        handled = []
+        wins = PROBE.get_windows_by_id(window_ids)
+        for win, attrs in wins.items():
+            if Window.load_window(win, attrs):
+                handled.append(win)
+
+        return handled
 
     # This loads a new window into PyTyle. It instantiates an object of this
     # class, and tells the window's screen that it needs to be retiled. It
@@ -44,22 +57,35 @@ class Window:
     # Note: This method also has logic to *skip* windows. Namely, it will
     # check to make sure that the window is in one of our stored desktops.
     # Also, it will make sure that it isn't a popup- otherwise it simply
-    # won't be tiled.
+    # won't be tiled. If the window has already been probed, its attributes
+    # can be passed along.
+    #
+    # Returns True if we're done with the window (it was loaded, or it's a
+    # popup or filtered), and False if it should be tried again later (we
+    # don't know its desktop or screen yet).
     @staticmethod
-    def load_window(window_id):
-        attrs = PROBE.get_window_by_id(window_id)
-        if not attrs['popup'] and attrs['desktop'] in State.get_desktops():
-            for viewport in State.get_desktops()[attrs['desktop']].viewports.values():
-                if viewport.is_on_viewport(attrs['x'], attrs['y']):
-                    for screen in viewport.screens.values():
-                        if screen.is_on_screen(attrs['x'], attrs['y']):
-                            win = Window(screen, attrs)
-                            if not win.filtered():
-                                screen.add_window(win)
-                                screen.needs_tiling()
-
-                                if win.id == PROBE.get_active_window_id():
-                                    win.activate()
+    def load_window(window_id, attrs = None):
+        if attrs is None:
+            attrs = PROBE.get_window_by_id(window_id)
+        if attrs['popup']:
+            return True
+        if attrs['desktop'] not in State.get_desktops():
+            return False
+
+        desktop = State.get_desktops()[attrs['desktop']]
+        screen = desktop.get_screen_at(attrs['x'], attrs['y'])
+        if not screen:
+            return False
+
+        win = Window(screen, attrs)
+        if not win.filtered():
+            screen.add_window(win)
+            screen.needs_tiling()
+
+            if win.id == PROBE.get_active_window_id():
+                win.activate()
+
+        return True
 
 
     #------------------------------------------------------------------------------
@@ -99,6 +125,7 @@ class Window:
     # Deletes the window from existence. It also makes sure to queue its screen
     # for tiling.
     def delete(self):
+        PROBE.forget_window(self.id)
         self.screen.delete_window(self)
         self.screen.needs_tiling()
         State.reload_active()
@@ -115,13 +142,10 @@ class Window:
 
         return False
 
-    # Tests to see if this window is still alive.
+    # Tests to see if this window is still alive. This doesn't talk to X- see
+    # Probe.is_alive.
     def lives(self):
-        try:
-            PROBE.get_window_geometry(self.xobj)
-        except:
-            return False
-        return True
+        return PROBE.is_alive(self.xobj)
 
     # Asks the window manager to maximize the window. It does not currently
     # resize to the max screen coordinates.
@@ -159,15 +183,15 @@ class Window:
         self.update_attributes(update)
 
         if olddesk.id != self.desktop or not oldviewport.is_on_viewport(update['x'], update['y']) or not oldscreen.is_on_screen(update['x'], update['y']):
-            for viewport in State.get_desktops()[self.desktop].viewports.values():
-                if viewport.is_on_viewport(update['x'], update['y']):
-                    for screen in viewport.screens.values():
-                        if screen.is_on_screen(update['x'], update['y']):
-                            oldscreen.delete_window(self)
-                            screen.add_window(self)
-                            screen.needs_tiling()
-                            oldscreen.needs_tiling()
-                            self.screen = screen
+            screen = State.get_desktops()[self.desktop].get_screen_at(
+                update['x'], update['y']
+            )
+            if screen:
+                oldscreen.delete_window(self)
+                screen.add_window(self)
+                screen.needs_tiling()
+                oldscreen.needs_tiling()
+                self.screen = screen
         elif oldstate != self.hidden:
             self.screen.needs_tiling()
 
@@ -264,4 +288,4 @@ class Window:
     # A simple string representation of the window. Useful for some debugging
     # purposes. Also see the string representations of desktop and screen.
     def __str__(self):
-        return self.title + ' - [ID: ' + str(self.id) + ', X: ' + str(self.x) + ', Y: ' + str(self.y) + ', WIDTH: ' + str(self.width) + ', HEIGHT: ' + str(self.height) + ', DESKTOP: ' + str(self.screen.viewport.desktop.id) + ', VIEWPORT: ' + str(self.screen.viewport.id) + ', SCREEN: ' + str(self.screen.id) + ']'
+        return self.title + ' - [ID: ' + hex(self.id) + ', X: ' + str(self.x) + ', Y: ' + str(self.y) + ', WIDTH: ' + str(self.width) + ', HEIGHT: ' + str(self.height) + ', DESKTOP: ' + str(self.screen.viewport.desktop.id) + ', VIEWPORT: ' + str(self.screen.viewport.id) + ', SCREEN: ' + str(self.screen.id) + ']'